@@ -0,0 +1,281 @@
+"""
+Offline benchmarks of command matching and events dispatching.
+
+Run from repository root:
+
+    python -m benchmarks.bench_dispatch --output bench_output.json
+
+Results are printed (or written) as JSON, so they can be compared between releases
+"""
+import argparse
+import asyncio
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from pyrogram import ContinuePropagation
+
+from kgemng import EventManager
+from kgemng.base import SkipMe
+from kgemng.dispatch import LaneStats, PriorityDispatcher, dispatch_update
+from benchmarks import synthetic
+
+COMMANDS = (1, 10, 100, 1000)
+HANDLERS = (1, 10, 100, 500)
+DEPTHS = (0, 1, 5, 15)
+TRIGGERS = (1, 10, 100, 1000)
+
+
+async def bench_match_command(number: int, repeat: int):
+    for commands in COMMANDS:
+        manager = synthetic.make_command_manager(commands)
+
+        for case, text in (
+            ("last", f".cmd{commands - 1} argument"),
+            ("miss", "just a regular message in a chat"),
+        ):
+            yield "match_command", {"commands": commands, "case": case}, (
+                await synthetic.measure(
+                    lambda: manager.match_command(text), number, repeat
+                )
+            )
+
+
+async def bench_feed_message(number: int, repeat: int):
+    client = await synthetic.make_client()
+    users = synthetic.make_users(synthetic.ACCOUNT_ID, synthetic.CHAT_ID)
+
+    for commands in COMMANDS:
+        manager = synthetic.make_command_manager(commands)
+
+        for case, text in (
+            ("last", f".cmd{commands - 1} argument"),
+            ("miss", "just a regular message in a chat"),
+        ):
+            update = synthetic.make_updates()["UpdateNewMessage"]
+            update.message.message = text
+            event = await EventManager.resolve_event(client, update, users, {})
+
+            async def call():
+                try:
+                    await manager.feed_message(client, event.message)
+                except SkipMe:
+                    pass
+
+            yield "feed_message", {"commands": commands, "case": case}, (
+                await synthetic.measure(call, number, repeat)
+            )
+
+
+async def bench_feed_event(number: int, repeat: int):
+    client = await synthetic.make_client()
+    users = synthetic.make_users(synthetic.ACCOUNT_ID, synthetic.CHAT_ID)
+    update = synthetic.make_updates()["UpdateNewMessage"]
+    event = await EventManager.resolve_event(client, update, users, {})
+
+    for handlers in HANDLERS:
+        manager = synthetic.make_event_manager(handlers)
+
+        for case, value in (("resolved", event), ("raw", update)):
+
+            async def call():
+                await manager.feed_event(client, value, users, {})
+
+            yield "feed_event", {"handlers": handlers, "case": case}, (
+                await synthetic.measure(call, number, repeat)
+            )
+
+
+async def bench_triggers(number: int, repeat: int):
+    client = await synthetic.make_client()
+    users = synthetic.make_users(synthetic.ACCOUNT_ID, synthetic.CHAT_ID)
+
+    for triggers in TRIGGERS:
+        update = synthetic.make_updates()["UpdateNewMessage"]
+        update.message.message = synthetic.trigger_text(triggers)
+
+        for case, regexp in (("automaton", False), ("regexp_handlers", True)):
+            manager = synthetic.make_trigger_manager(triggers, regexp=regexp)
+
+            async def call():
+                await manager.feed_event(client, update, users, {})
+
+            yield "triggers", {"triggers": triggers, "case": case}, (
+                await synthetic.measure(call, number, repeat)
+            )
+
+
+async def bench_nested_managers(number: int, repeat: int):
+    client = await synthetic.make_client()
+    users = synthetic.make_users(synthetic.ACCOUNT_ID, synthetic.CHAT_ID)
+    update = synthetic.make_updates()["UpdateNewMessage"]
+
+    for depth in DEPTHS:
+        root = synthetic.make_nested_event_managers(depth)
+
+        async def call():
+            try:
+                await root.execute(client, update, users, {})
+            except ContinuePropagation:
+                pass
+
+        yield "nested_managers", {"depth": depth}, (
+            await synthetic.measure(call, number, repeat)
+        )
+
+
+async def bench_resolve_event(number: int, repeat: int):
+    client = await synthetic.make_client()
+    users = synthetic.make_users(synthetic.ACCOUNT_ID, synthetic.CHAT_ID)
+
+    for name, update in synthetic.make_updates().items():
+
+        async def call():
+            await EventManager.resolve_event(client, update, users, {})
+
+        yield "resolve_event", {"update": name}, (
+            await synthetic.measure(call, number, repeat)
+        )
+
+
+async def bench_serialize_event(number: int, repeat: int):
+    client = await synthetic.make_client()
+    users = synthetic.make_users(synthetic.ACCOUNT_ID, synthetic.CHAT_ID)
+
+    for name, update in synthetic.make_updates().items():
+        event = await EventManager.resolve_event(client, update, users, {})
+
+        for case, serialize in (("str", event.__str__), ("json_line", event.to_json)):
+            yield "serialize_event", {"update": name, "case": case}, (
+                await synthetic.measure(serialize, number, repeat)
+            )
+
+
+async def bench_priority_lane(number: int, _):
+    """Latency of owner commands fed among `number` updates, that are handled by slow event handler"""
+    client = await synthetic.make_client()
+    users = synthetic.make_users(synthetic.ACCOUNT_ID, synthetic.CHAT_ID)
+
+    event_manager = EventManager(addon=None, enabled=True)
+
+    @event_manager.on_message()
+    async def slow_handler(_):
+        await asyncio.sleep(0.0005)
+
+    managers = (synthetic.make_command_manager(10), event_manager)
+    # Command in the middle of every 50 updates, there is at least one command
+    offset = min(25, number // 2)
+    updates = [
+        synthetic.make_priority_update(index % 50 == offset) for index in range(number)
+    ]
+
+    dispatcher = PriorityDispatcher(managers)
+    dispatcher.start()
+    for update in updates:
+        await dispatcher.feed_update(client, update, users, {})
+    await dispatcher.stop()
+
+    for lane, stats in dispatcher.stats.items():
+        yield "priority_lane", {"case": "lanes", "lane": lane}, {
+            "updates": stats.updates,
+            "latency_p50_ms": stats.latency_percentile(50) * 1000,
+            "latency_p99_ms": stats.latency_percentile(99) * 1000,
+            "wait_max_ms": stats.wait_max * 1000,
+        }
+
+    # Without lanes all updates are received at once and handled one by one
+    received = time.perf_counter()
+    stats = LaneStats()
+    for update in updates:
+        await dispatch_update(client, update, users, {}, managers)
+        if update.message.out:
+            stats.latencies.append(time.perf_counter() - received)
+
+    yield "priority_lane", {"case": "single", "lane": "commands"}, {
+        "updates": len(stats.latencies),
+        "latency_p50_ms": stats.latency_percentile(50) * 1000,
+        "latency_p99_ms": stats.latency_percentile(99) * 1000,
+    }
+
+
+async def bench_event_memory(number: int, _):
+    client = await synthetic.make_client()
+    users = synthetic.make_users(synthetic.ACCOUNT_ID, synthetic.CHAT_ID)
+
+    for name, update in synthetic.make_updates().items():
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+
+        events = [
+            await EventManager.resolve_event(client, update, users, {})
+            for _ in range(number)
+        ]
+
+        after, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        yield "event_memory", {"update": name}, {
+            "retained_bytes": (after - before) / number,
+            "peak_bytes": (peak - before) / number,
+            "number": number,
+        }
+
+        del events
+        client.message_cache.store.clear()
+
+
+BENCHMARKS = {
+    "match_command": bench_match_command,
+    "feed_message": bench_feed_message,
+    "feed_event": bench_feed_event,
+    "nested_managers": bench_nested_managers,
+    "triggers": bench_triggers,
+    "resolve_event": bench_resolve_event,
+    "serialize_event": bench_serialize_event,
+    "priority_lane": bench_priority_lane,
+    "event_memory": bench_event_memory,
+}
+
+
+async def run(names: list[str], number: int, repeat: int) -> dict:
+    results = []
+
+    for name in names:
+        async for benchmark, params, stats in BENCHMARKS[name](number, repeat):
+            results.append({"benchmark": benchmark, "params": params, **stats})
+            print(benchmark, params, file=sys.stderr)
+
+    return {
+        "meta": synthetic.environment(number=number, repeat=repeat),
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        choices=(*BENCHMARKS, []),
+        help="benchmarks to run (all by default)",
+    )
+    parser.add_argument("-n", "--number", type=int, default=1000)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("-o", "--output", help="write JSON results to file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.benchmarks or list(BENCHMARKS), args.number, args.repeat))
+
+    dump = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(dump)
+    else:
+        print(dump)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Import time of kgemng entry points, measured with `python -X importtime`.
+
+Run from repository root:
+
+    python -m benchmarks.bench_import --check
+
+With --check the exit status is non-zero if an entry point imports heavy dependency
+it must not import, or takes longer than --max-ms
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+
+from benchmarks import synthetic
+
+HEAVY_MODULES = ("pyrogram", "pydantic", "magic_filter")
+
+# Statement -> heavy modules it must not import
+ENTRY_POINTS = {
+    "import kgemng": HEAVY_MODULES,
+    "from kgemng import BaseManager": HEAVY_MODULES,
+    "from kgemng.command import Command, CommandManager": HEAVY_MODULES,
+    "from kgemng import EventManager": (),
+}
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def measure(statement: str) -> dict:
+    # Fresh interpreter for each measurement, so nothing is imported already
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    total_us = 0
+    modules = set()
+    for line in process.stderr.splitlines():
+        match = _LINE.match(line)
+        if match is None:
+            continue
+
+        total_us += int(match.group(1))
+        modules.add(match.group(4))
+
+    return {
+        "total_ms": total_us / 1000,
+        "modules": len(modules),
+        "heavy_modules": [name for name in HEAVY_MODULES if name in modules],
+    }
+
+
+def run(repeat: int) -> dict:
+    results = []
+
+    for statement, forbidden in ENTRY_POINTS.items():
+        measurements = [measure(statement) for _ in range(repeat)]
+
+        results.append(
+            {
+                "benchmark": "import",
+                "params": {"statement": statement},
+                "median_ms": sorted(m["total_ms"] for m in measurements)[repeat // 2],
+                "modules": measurements[0]["modules"],
+                "heavy_modules": measurements[0]["heavy_modules"],
+                "forbidden_modules": list(forbidden),
+            }
+        )
+
+    return {"meta": synthetic.environment(repeat=repeat), "results": results}
+
+
+def check(report: dict, max_ms: float | None) -> list[str]:
+    failures = []
+
+    for result in report["results"]:
+        statement = result["params"]["statement"]
+
+        imported = set(result["heavy_modules"]) & set(result["forbidden_modules"])
+        if imported:
+            failures.append(f"{statement!r} imports {', '.join(sorted(imported))}")
+
+        if (
+            max_ms is not None
+            and result["forbidden_modules"]
+            and result["median_ms"] > max_ms
+        ):
+            failures.append(
+                f"{statement!r} takes {result['median_ms']:.1f}ms (limit {max_ms}ms)"
+            )
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("-o", "--output", help="write JSON results to file")
+    parser.add_argument("--check", action="store_true", help="fail on import regressions")
+    parser.add_argument(
+        "--max-ms",
+        type=float,
+        default=None,
+        help="import time limit of entry points that must not import heavy modules",
+    )
+    args = parser.parse_args()
+
+    report = run(args.repeat)
+
+    dump = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(dump)
+    else:
+        print(dump)
+
+    if args.check:
+        failures = check(report, args.max_ms)
+
+        for failure in failures:
+            print(f"FAIL: {failure}", file=sys.stderr)
+
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark of managers construction, the part of addons loading done by kgemng.
+
+Run from repository root:
+
+    python -m benchmarks.bench_startup --output startup.json
+
+Managers are constructed from a module of temporary addon, so addon resolution works as in real addons
+"""
+import argparse
+import importlib.util
+import inspect
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from kgemng.base import get_addon
+from benchmarks import synthetic
+
+COUNTS = (10, 100, 1000)
+
+ADDON_META = {
+    "name": "benchmark-addon",
+    "version": "0.0.1",
+    "description": "Addon used by kgemng startup benchmark",
+    "author": "kgemng",
+}
+
+ADDON_MODULE = """
+from kgemng import CommandManager, EventManager
+
+
+def make_managers(count):
+    for _ in range(count):
+        managers = CommandManager(), EventManager()
+
+    return managers
+"""
+
+
+def load_addon_module(directory: Path):
+    (directory / "addon.json").write_text(json.dumps(ADDON_META))
+    (directory / "managers.py").write_text(ADDON_MODULE)
+
+    spec = importlib.util.spec_from_file_location(
+        "benchmark_addon_managers", directory / "managers.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def measure(call, count: int, repeat: int) -> dict:
+    results = []
+
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        call(count)
+        results.append((time.perf_counter_ns() - start) / count)
+
+    return {"median_ns": sorted(results)[len(results) // 2], "min_ns": min(results)}
+
+
+def legacy_stack(count: int):
+    # Cost of inspect.stack() call previously done for every manager
+    for _ in range(count):
+        inspect.stack()
+
+
+def run(repeat: int) -> dict:
+    results = []
+
+    # Addon must be located in the working directory
+    with tempfile.TemporaryDirectory(dir=".") as directory:
+        module = load_addon_module(Path(directory))
+
+        for manager in module.make_managers(1):
+            if manager.addon is None or manager.addon.meta.name != ADDON_META["name"]:
+                raise RuntimeError(f"Addon of {manager} is not resolved")
+
+        for count in COUNTS:
+            get_addon.cache_clear()
+            start = time.perf_counter_ns()
+            module.make_managers(1)
+            results.append(
+                {
+                    "benchmark": "first_manager_pair",
+                    "params": {"count": count},
+                    "ns": time.perf_counter_ns() - start,
+                }
+            )
+
+            results.append(
+                {
+                    "benchmark": "manager_pair",
+                    "params": {"count": count},
+                    **measure(module.make_managers, count, repeat),
+                }
+            )
+
+            results.append(
+                {
+                    "benchmark": "legacy_inspect_stack",
+                    "params": {"count": count},
+                    # inspect.stack() takes milliseconds, so it is measured on at most 100 calls
+                    **measure(legacy_stack, min(count, 100), repeat),
+                }
+            )
+
+            print("startup", count, file=sys.stderr)
+
+    return {"meta": synthetic.environment(repeat=repeat), "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("-o", "--output", help="write JSON results to file")
+    args = parser.parse_args()
+
+    dump = json.dumps(run(args.repeat), indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(dump)
+    else:
+        print(dump)
+
+
+if __name__ == "__main__":
+    main()
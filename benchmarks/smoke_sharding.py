@@ -0,0 +1,182 @@
+"""
+Smoke check of sharded dispatch with replay clients in spawned worker processes.
+
+Run from repository root:
+
+    python -m benchmarks.smoke_sharding
+
+Checks that updates of every chat are handled in the order they were fed,
+that a killed worker is restarted and handles new updates, and that workers connect
+clients created by async factory and disconnect them when stopped
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from kgemng import EventManager
+from kgemng.replay import ReplayClient
+from kgemng.sharding import ShardedDispatcher
+from benchmarks import synthetic
+
+# Workers are spawned, so they get output directory from environment
+OUTPUT_ENV = "KGEMNG_SMOKE_OUTPUT"
+
+
+async def _record_message(event):
+    # Random delay lets later updates overtake this one, if ordering is broken
+    await asyncio.sleep(random.random() / 1000)
+
+    message = event.message
+    with open(Path(os.environ[OUTPUT_ENV]) / f"{os.getpid()}.txt", "a") as file:
+        file.write(f"{message.chat.id} {message.id}\n")
+
+
+def managers_factory():
+    manager = EventManager(addon=None, enabled=True)
+    manager.register_message_handler(_record_message)
+    return [manager]
+
+
+class SmokeClient(ReplayClient):
+    """Replay client, that is created disconnected and rejects requests until connected, like pyrogram"""
+
+    def __init__(self, account_id: int | None):
+        super().__init__(account_id)
+        self.is_connected = False
+
+    async def connect(self) -> bool:
+        self.is_connected = True
+        return True
+
+    async def disconnect(self):
+        await super().disconnect()
+        _write_mark("disconnected")
+
+    async def get_me(self):
+        if not self.is_connected:
+            raise ConnectionError("Client has not been started yet")
+
+        return self.me
+
+
+def _write_mark(name: str):
+    (Path(os.environ[OUTPUT_ENV]) / f"{os.getpid()}.{name}").touch()
+
+
+async def client_factory(account_id):
+    return SmokeClient(account_id)
+
+
+def read_handled(output: Path) -> dict[int, list[int]]:
+    handled = {}
+
+    for path in output.glob("*.txt"):
+        for line in path.read_text().splitlines():
+            chat_id, message_id = map(int, line.split())
+            handled.setdefault(chat_id, []).append(message_id)
+
+    return handled
+
+
+async def wait_handled(output: Path, count: int, timeout: float) -> dict[int, list[int]]:
+    deadline = time.monotonic() + timeout
+
+    while True:
+        handled = read_handled(output)
+        if sum(map(len, handled.values())) >= count or time.monotonic() > deadline:
+            return handled
+
+        await asyncio.sleep(0.1)
+
+
+async def feed(dispatcher: ShardedDispatcher, first_id: int, updates: int, chats: int):
+    client = await synthetic.make_client()
+    users = synthetic.make_users(synthetic.ACCOUNT_ID)
+
+    for message_id in range(first_id, first_id + updates):
+        chat_id = synthetic.CHAT_ID + message_id % chats
+        users.setdefault(chat_id, synthetic.make_user(chat_id))
+
+        update = synthetic.make_updates()["UpdateNewMessage"]
+        update.message = synthetic.make_message(
+            "hello", message_id=message_id, chat_id=chat_id, outgoing=False
+        )
+        await dispatcher.feed_update(client, update, users, {})
+
+
+async def run(workers: int, updates: int, chats: int, timeout: float) -> list[str]:
+    errors = []
+
+    with tempfile.TemporaryDirectory() as output:
+        output = Path(output)
+        os.environ[OUTPUT_ENV] = str(output)
+
+        dispatcher = ShardedDispatcher(managers_factory, client_factory, workers=workers)
+        dispatcher.start()
+        killed = None
+
+        try:
+            await feed(dispatcher, 0, updates, chats)
+            handled = await wait_handled(output, updates, timeout)
+            handled_before = sum(map(len, handled.values()))
+
+            if handled_before != updates:
+                errors.append(f"handled {handled_before} of {updates} updates")
+
+            for chat_id, message_ids in handled.items():
+                if message_ids != sorted(message_ids):
+                    errors.append(f"updates of chat {chat_id} are handled out of order")
+
+            # noinspection PyProtectedMember
+            killed = dispatcher._processes[0]
+            killed.kill()
+            killed.join()
+
+            restarted = dispatcher.check_workers()
+            if restarted != 1:
+                errors.append(f"restarted {restarted} workers instead of 1")
+
+            await feed(dispatcher, updates, updates, chats)
+            handled = await wait_handled(output, handled_before + updates, timeout)
+            handled_after = sum(map(len, handled.values())) - handled_before
+
+            if handled_after != updates:
+                errors.append(f"handled {handled_after} of {updates} updates after restart")
+        finally:
+            dispatcher.stop(timeout)
+
+        # Every worker, that handled updates and wasn't killed, disconnects its client
+        for path in output.glob("*.txt"):
+            pid = int(path.stem)
+            if (killed is None or pid != killed.pid) and not (output / f"{pid}.disconnected").exists():
+                errors.append(f"worker {pid} didn't disconnect its client")
+
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-w", "--workers", type=int, default=3)
+    parser.add_argument("-u", "--updates", type=int, default=300)
+    parser.add_argument("-c", "--chats", type=int, default=12)
+    parser.add_argument("-t", "--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    errors = asyncio.run(run(args.workers, args.updates, args.chats, args.timeout))
+
+    for error in errors:
+        print(error, file=sys.stderr)
+
+    if errors:
+        sys.exit(1)
+
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
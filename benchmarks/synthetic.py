@@ -0,0 +1,207 @@
+"""Synthetic raw updates and managers trees for benchmarks"""
+import asyncio
+import platform
+import statistics
+import time
+import typing
+from importlib import metadata
+
+from magic_filter import F
+from pyrogram import raw
+
+from kgemng import CommandManager, EventManager, NewMessageEvent
+from kgemng.replay import ReplayClient
+
+ACCOUNT_ID = 1000
+CHAT_ID = 2000
+CHANNEL_ID = 3000
+
+
+def make_user(user_id: int) -> raw.types.User:
+    return raw.types.User(
+        id=user_id,
+        first_name=f"user{user_id}",
+        access_hash=0,
+        restriction_reason=[],
+        usernames=[],
+    )
+
+
+def make_users(*ids: int) -> dict[int, raw.types.User]:
+    return {user_id: make_user(user_id) for user_id in ids}
+
+
+def make_message(
+    text: str, message_id: int = 1, chat_id: int = CHAT_ID, outgoing: bool = True
+) -> raw.types.Message:
+    return raw.types.Message(
+        id=message_id,
+        peer_id=raw.types.PeerUser(user_id=chat_id),
+        from_id=raw.types.PeerUser(user_id=ACCOUNT_ID if outgoing else chat_id),
+        out=outgoing,
+        date=0,
+        message=text,
+        entities=[],
+    )
+
+
+def make_updates() -> dict[str, raw.base.Update]:
+    """One update of each class resolve_event supports"""
+    return {
+        "UpdateNewMessage": raw.types.UpdateNewMessage(
+            message=make_message("hello"), pts=0, pts_count=0
+        ),
+        "UpdateEditMessage": raw.types.UpdateEditMessage(
+            message=make_message("hello"), pts=0, pts_count=0
+        ),
+        "UpdateDeleteMessages": raw.types.UpdateDeleteMessages(
+            messages=[1, 2, 3], pts=0, pts_count=0
+        ),
+        "UpdateReadHistoryInbox": raw.types.UpdateReadHistoryInbox(
+            peer=raw.types.PeerUser(user_id=CHAT_ID),
+            max_id=1,
+            still_unread_count=0,
+            pts=0,
+            pts_count=0,
+        ),
+        "UpdateReadHistoryOutbox": raw.types.UpdateReadHistoryOutbox(
+            peer=raw.types.PeerUser(user_id=CHAT_ID), max_id=1, pts=0, pts_count=0
+        ),
+        "UpdateReadChannelInbox": raw.types.UpdateReadChannelInbox(
+            channel_id=CHANNEL_ID, max_id=1, still_unread_count=0, pts=0
+        ),
+        "UpdateDeleteChannelMessages": raw.types.UpdateDeleteChannelMessages(
+            channel_id=CHANNEL_ID, messages=[1, 2, 3], pts=0, pts_count=0
+        ),
+    }
+
+
+async def make_client() -> ReplayClient:
+    client = ReplayClient(ACCOUNT_ID)
+    await client.account.resolve_info()
+    return client
+
+
+async def _noop(*_):
+    pass
+
+
+def make_command_manager(commands: int) -> CommandManager:
+    manager = CommandManager(addon=None)
+
+    for index in range(commands):
+        manager.register_command(_noop, f"cmd{index}", description=f"command {index}")
+
+    return manager
+
+
+def make_event_manager(handlers: int, chat_id: int = CHAT_ID) -> EventManager:
+    """Manager with handlers filtering by chat id. Only the last handler matches chat_id"""
+    manager = EventManager(addon=None, enabled=True)
+
+    for index in range(handlers):
+        target = chat_id if index == handlers - 1 else -index - 1
+        manager.register_message_handler(
+            _noop, filter_=(F.message.chat.id == target) & F.message.text
+        )
+
+    return manager
+
+
+def make_trigger_manager(triggers: int, regexp: bool = False) -> EventManager:
+    """
+    Manager with keyword triggers "wordN". Only the last one is found in TRIGGER_TEXT.
+    With regexp=True every handler checks its own regular expression, as addons did before triggers
+    """
+    manager = EventManager(addon=None, enabled=True)
+
+    for index in range(triggers):
+        keyword = f"word{index if index == triggers - 1 else -index - 1}"
+
+        if regexp:
+            manager.register_message_handler(
+                _noop,
+                filter_=F.message.text.regexp(rf"(?i)(?<!\w){keyword}(?!\w)", mode="search"),
+            )
+        else:
+            manager.register_trigger_handler(_noop, keyword)
+
+    return manager
+
+
+def trigger_text(triggers: int, words: int = 40) -> str:
+    """Message text of `words` words, that contains keyword of the last trigger"""
+    return " ".join(["lorem ipsum"] * (words // 2) + [f"Word{triggers - 1}!"])
+
+
+def make_priority_update(command: bool) -> raw.types.UpdateNewMessage:
+    """Outgoing ".cmd0" command or incoming message of the chat"""
+    return raw.types.UpdateNewMessage(
+        message=make_message(".cmd0" if command else "hello", outgoing=command),
+        pts=0,
+        pts_count=0,
+    )
+
+
+def make_nested_event_managers(depth: int) -> EventManager:
+    """Chain of managers, where only the deepest one has matching handler"""
+    root = manager = make_event_manager(1, chat_id=-1)
+
+    for _ in range(depth):
+        child = make_event_manager(1, chat_id=-1)
+        manager.include_manager(child)
+        manager = child
+
+    manager.on_event(NewMessageEvent, by_me=False)(_noop)
+
+    return root
+
+
+async def measure(
+    call: typing.Callable[[], typing.Awaitable | typing.Any],
+    number: int = 1000,
+    repeat: int = 5,
+) -> dict[str, float]:
+    """Measure call in nanoseconds per operation. Returns median, min and stdev of repeats"""
+    iscoro = asyncio.iscoroutinefunction(call)
+    results = []
+
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+
+        for _ in range(number):
+            if iscoro:
+                await call()
+            else:
+                call()
+
+        results.append((time.perf_counter_ns() - start) / number)
+
+    return {
+        "median_ns": statistics.median(results),
+        "min_ns": min(results),
+        "stdev_ns": statistics.stdev(results) if len(results) > 1 else 0.0,
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def _version(package: str) -> str | None:
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def environment(**extra) -> dict:
+    """Metadata saved with results, so they can be compared between releases and machines"""
+    return {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "kgemng": _version("kgemng"),
+        "pyrogram": _version("pyrogram"),
+        "pydantic": _version("pydantic"),
+        **extra,
+    }
@@ -1,9 +1,45 @@
-from .command import CommandManager
-from .event import (
-    Event,
-    EditedMessageEvent,
-    NewMessageEvent,
-    MessageReadEvent,
-    DeletedMessagesEvent,
-    EventManager,
-)
+import importlib
+import typing
+
+if typing.TYPE_CHECKING:
+    from .base import BaseManager
+    from .command import CommandManager
+    from .event import (
+        Event,
+        EditedMessageEvent,
+        NewMessageEvent,
+        MessageReadEvent,
+        DeletedMessagesEvent,
+        EventManager,
+    )
+
+# Public names are imported on first access, so tools that need only part of the package
+# don't import pyrogram, pydantic and magic_filter
+_LAZY_NAMES = {
+    "BaseManager": ".base",
+    "CommandManager": ".command",
+    "Event": ".event",
+    "EditedMessageEvent": ".event",
+    "NewMessageEvent": ".event",
+    "MessageReadEvent": ".event",
+    "DeletedMessagesEvent": ".event",
+    "EventManager": ".event",
+}
+
+__all__ = tuple(_LAZY_NAMES)
+
+
+def __getattr__(name: str):
+    module_name = _LAZY_NAMES.get(name)
+
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+    return sorted({*globals(), *__all__})
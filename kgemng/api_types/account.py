@@ -1,3 +1,8 @@
+import asyncio
+import inspect
+import logging
+from typing import Callable, Any
+
 from pyrogram import Client, types
 
 
@@ -13,51 +18,186 @@ class Account:
 
     def __init__(self, client: Client):
         self._client = client
+        self._info = None
+
+        # Handlers read account data as client.account
+        client.account = self
 
     async def resolve_info(self) -> types.User:
-        raise NotImplementedError()
+        self._info = await self._client.get_me()
+
+        if self._manager is not None:
+            self._manager.index_account(self)
+
+        return self._info
+
+    def is_resolved(self) -> bool:
+        return self._info is not None
+
+    @property
+    def id(self) -> int | None:
+        return self._info.id if self._info else None
 
     @property
     def info(self) -> types.User:
-        raise NotImplementedError()
+        if self._info is None:
+            raise ValueError(
+                "Account info is not resolved. Call resolve_info() before using it"
+            )
+
+        return self._info
 
     @property
     def client(self) -> Client:
-        raise NotImplementedError()
+        return self._client
 
     @property
     def manager(self) -> "AccountManager":
-        raise NotImplementedError()
+        return self._manager
 
     @manager.setter
     def manager(self, manager: "AccountManager"):
-        raise NotImplementedError()
+        if not isinstance(manager, AccountManager) and manager is not None:
+            raise ValueError(
+                "Cannot operate with {type} as account manager".format(
+                    type=type(manager)
+                )
+            )
+
+        self._manager = manager
 
     def __str__(self):
-        raise NotImplementedError()
+        if self._info is None:
+            return f"Account(name={self._client.name!r}, resolved=False)"
+
+        return (
+            f"Account(name={self._client.name!r}, id={self._info.id}, "
+            f"username={self._info.username!r})"
+        )
+
+    __repr__ = __str__
 
 
 class AccountManager:
 
     _accounts: list[Account]
 
-    def __init__(self):
-        raise NotImplementedError()
+    def __init__(self, concurrency_limit: int = 10, log_level: int = logging.WARNING):
+        if not isinstance(concurrency_limit, int) or concurrency_limit < 1:
+            raise ValueError(
+                "Cannot operate with {value} as concurrency limit".format(
+                    value=repr(concurrency_limit)
+                )
+            )
 
-    def add_account(self, account: Account | Client):
-        raise NotImplementedError()
+        self._accounts = []
+        self._accounts_by_id: dict[int, Account] = {}
 
-    def pop_account(self, index: int) -> Account | None:
-        raise NotImplementedError()
+        self._concurrency_limit = concurrency_limit
 
-    def get_account(self, index: int):
-        raise NotImplementedError()
+        self._logger = logging.getLogger(type(self).__name__)
+        self._logger.setLevel(log_level)
 
-    def get_accounts(self):
-        raise NotImplementedError()
+    @property
+    def concurrency_limit(self) -> int:
+        return self._concurrency_limit
+
+    def index_account(self, account: Account):
+        if account.manager is not self:
+            raise ValueError(f"{account} is not managed by this manager")
+
+        if account.is_resolved():
+            self._accounts_by_id[account.id] = account
+
+    def add_account(self, account: Account | Client) -> Account:
+        if isinstance(account, Client):
+            account = Account(account)
+
+        if not isinstance(account, Account):
+            raise ValueError(
+                "Cannot operate with {type} as account".format(type=type(account))
+            )
+
+        if account.manager is not None and account.manager is not self:
+            account.manager.remove_account(account)
 
-    def foreach(self, callback, *args, **kwargs):
-        raise NotImplementedError()
+        if account in self._accounts:
+            return account
 
-    async def async_foreach(self, callback, *args, **kwargs):
-        raise NotImplementedError()
+        account.manager = self
+        self._accounts.append(account)
+        self.index_account(account)
+
+        self._logger.debug(f"Added account {account}")
+
+        return account
+
+    def remove_account(self, account: Account) -> bool:
+        try:
+            index = self._accounts.index(account)
+        except ValueError:
+            return False
+
+        return self.pop_account(index) is not None
+
+    def pop_account(self, index: int) -> Account | None:
+        try:
+            account = self._accounts.pop(index)
+        except IndexError:
+            return None
+
+        if account.is_resolved() and self._accounts_by_id.get(account.id) is account:
+            del self._accounts_by_id[account.id]
+
+        account.manager = None
+
+        self._logger.debug(f"Removed account {account}")
+
+        return account
+
+    def get_account(self, index: int) -> Account | None:
+        try:
+            return self._accounts[index]
+        except IndexError:
+            return None
+
+    def get_account_by_id(self, account_id: int) -> Account | None:
+        return self._accounts_by_id.get(account_id)
+
+    def get_accounts(self) -> list[Account]:
+        return self._accounts.copy()
+
+    async def resolve_accounts(self) -> list[types.User | BaseException]:
+        """Resolve info of every account in parallel. Must be called once at startup"""
+        return await self.async_foreach(lambda account: account.resolve_info())
+
+    def foreach(self, callback: Callable[..., Any], *args, **kwargs) -> list[Any]:
+        return [callback(account, *args, **kwargs) for account in self.get_accounts()]
+
+    async def async_foreach(
+        self, callback: Callable[..., Any], *args, **kwargs
+    ) -> list[Any | BaseException]:
+        """
+        Call callback for every account concurrently, but not more than concurrency limit at once.
+        Error raised for one account doesn't affect the others and is returned in place of its result
+        """
+        semaphore = asyncio.Semaphore(self._concurrency_limit)
+
+        async def run(account: Account):
+            async with semaphore:
+                try:
+                    result = callback(account, *args, **kwargs)
+
+                    if inspect.isawaitable(result):
+                        result = await result
+
+                    return result
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exc:
+                    self._logger.exception(
+                        f"Error occurred while executing callback for {account}"
+                    )
+                    return exc
+
+        return list(await asyncio.gather(*map(run, self.get_accounts())))
@@ -1,12 +1,17 @@
+import functools
 import inspect
 import logging
+import os
+import sys
 import timeit
 from pathlib import Path
 from types import FunctionType
-from typing import Callable, Union, Any
+from typing import Callable, Union, Any, TYPE_CHECKING
 
 from RelativeAddonsSystem import Addon
-from pyrogram import ContinuePropagation, StopPropagation
+
+if TYPE_CHECKING:
+    from .profiling import HandlerProfiler
 
 
 class SkipMe(Exception):
@@ -17,16 +22,55 @@ class AddonNotSet:
     pass
 
 
-def try_to_get_addon(back_for: int = 3):
-    try:
-        frame_info = inspect.stack()[back_for]
+@functools.lru_cache(maxsize=None)
+def propagation_exceptions() -> tuple[type[BaseException], ...]:
+    """
+    Pyrogram propagation control exceptions.
+    Pyrogram is imported on first use, so importing managers base doesn't import the whole pyrogram
+    """
+    from pyrogram import ContinuePropagation, StopPropagation
+
+    return ContinuePropagation, StopPropagation
 
-        return Addon(Path(frame_info.filename).parent)
 
+@functools.lru_cache(maxsize=None)
+def get_addon(directory: str) -> Addon | None:
+    """Get addon located at directory. Addons are cached, so metadata is read once per directory"""
+    try:
+        return Addon(Path(directory))
     except FileNotFoundError:
         return None
 
 
+def get_callback_addon(callback: Callable) -> Addon | None:
+    """Get addon where callback is defined"""
+    code = getattr(inspect.unwrap(callback), "__code__", None)
+
+    if code is None:
+        return None
+
+    try:
+        return get_addon(os.path.dirname(code.co_filename))
+    except ValueError:
+        # Addon outside the working directory
+        return None
+
+
+def addon_key(addon: Addon | None) -> Path | None:
+    """Key of addon in registries. Different Addon objects of the same directory have the same key"""
+    return addon.path if isinstance(addon, Addon) else None
+
+
+def try_to_get_addon(back_for: int = 3):
+    try:
+        # sys._getframe doesn't build frames info and doesn't read source files, unlike inspect.stack
+        frame = sys._getframe(back_for)
+    except ValueError:
+        return None
+
+    return get_addon(os.path.dirname(frame.f_code.co_filename))
+
+
 class BaseManager:
     NO_ADDON = None
 
@@ -67,6 +111,8 @@ class BaseManager:
 
         self._addon = addon
 
+        self._profiler: "HandlerProfiler | None" = None
+
     def __repr__(self):
         addon_name = self._addon.meta.name if self._addon else "NO ADDON"
 
@@ -129,6 +175,20 @@ class BaseManager:
     def addon(self):
         return self._addon
 
+    def set_profiler(self, profiler: "HandlerProfiler | None"):
+        """Set profiler (kgemng.profiling.HandlerProfiler) of this manager and its included managers"""
+        self._profiler = profiler
+
+    def get_profiler(self) -> "HandlerProfiler | None":
+        manager = self
+        while manager is not None:
+            if manager._profiler is not None:
+                return manager._profiler
+
+            manager = manager.parent
+
+        return None
+
     def disable(self):
         self._enabled = False
         self._logger.debug("Manager is disabled")
@@ -167,13 +227,17 @@ class BaseManager:
             if self.parent is not None:
                 raise SkipMe
             else:
-                raise ContinuePropagation
+                continue_propagation, _ = propagation_exceptions()
+                raise continue_propagation
 
         return result
 
     async def execute(self, *args, **kwargs):
+        # Arguments are formatted only if debug logging is enabled
         self._logger.debug(
-            f"Executing manager with arguments > positional: {args} | keyword: {kwargs}"
+            "Executing manager with arguments > positional: %s | keyword: %s",
+            args,
+            kwargs,
         )
         if not self._enabled:
             self._logger.debug("Manager is disabled > exit")
@@ -200,7 +264,8 @@ class BaseManager:
                 await result
         except SkipMe:
             skipped = True
-        except (ContinuePropagation, StopPropagation):
+        # Expression of except clause is evaluated only when exception is raised
+        except propagation_exceptions():
             raise
         except BaseException as exc:
             if self._error_handler:
@@ -217,7 +282,7 @@ class BaseManager:
         finally:
             status = "executed" if not skipped else "skipped"
             self._logger.debug(
-                f"Manager {status}. Took {(timeit.default_timer() - start) * 1000:2f}ms"
+                "Manager %s. Took %2fms", status, (timeit.default_timer() - start) * 1000
             )
 
         if skipped:
@@ -0,0 +1,79 @@
+import io
+import pickle
+
+from pyrogram.raw.all import objects
+from pyrogram.raw.base import Update
+from pyrogram.raw.core import TLObject
+
+
+def _make_tl_object(constructor_id: int, values: tuple):
+    cls = objects.get(constructor_id)
+
+    if cls is None or len(values) != len(cls.__slots__):
+        raise pickle.UnpicklingError(
+            f"Cannot decode TL object of constructor {constructor_id}"
+        )
+
+    obj = cls.__new__(cls)
+
+    for name, value in zip(cls.__slots__, values):
+        setattr(obj, name, value)
+
+    return obj
+
+
+class _Pickler(pickle.Pickler):
+    # TL objects are reduced to their constructor id and slot values.
+    # TLObject.write is not used, because it doesn't round-trip objects with empty optional vectors
+    def reducer_override(self, obj):
+        if isinstance(obj, TLObject) and hasattr(obj, "ID"):
+            return _make_tl_object, (
+                obj.ID,
+                tuple(getattr(obj, name) for name in obj.__slots__),
+            )
+
+        return NotImplemented
+
+
+def dumps(value) -> bytes:
+    buffer = io.BytesIO()
+    _Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(value)
+    return buffer.getvalue()
+
+
+class _Unpickler(pickle.Unpickler):
+    # Encoded data can come from another machine, so it can't reference anything,
+    # except constructor of TL objects. Other values are plain builtins without globals
+    def find_class(self, module, name):
+        if (module, name) == (__name__, _make_tl_object.__name__):
+            return _make_tl_object
+
+        raise pickle.UnpicklingError(f"Global {module}.{name} is forbidden")
+
+
+def loads(data: bytes):
+    return _Unpickler(io.BytesIO(data)).load()
+
+
+def encode_update(
+    account_id: int | None,
+    update: Update,
+    users: dict[int, TLObject],
+    chats: dict[int, TLObject],
+) -> bytes:
+    """Encode raw update with its users and chats into compact binary form"""
+    return dumps((account_id, update, tuple(users.values()), tuple(chats.values())))
+
+
+def decode_update(
+    data: bytes,
+) -> tuple[int | None, Update, dict[int, TLObject], dict[int, TLObject]]:
+    """Decode data produced by encode_update"""
+    account_id, update, users, chats = loads(data)
+
+    return (
+        account_id,
+        update,
+        {user.id: user for user in users},
+        {chat.id: chat for chat in chats},
+    )
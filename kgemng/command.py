@@ -1,15 +1,20 @@
+import contextlib
 import copy
 import logging
 import typing
 from dataclasses import dataclass
 from inspect import iscoroutinefunction
+from pathlib import Path
 
 from named_locks import AsyncNamedLock
 from RelativeAddonsSystem import Addon
-from pyrogram import types
 
-from .api_types import ExtendedClient
-from .base import BaseManager, AddonNotSet, SkipMe
+from .base import BaseManager, AddonNotSet, SkipMe, addon_key, get_callback_addon
+
+if typing.TYPE_CHECKING:
+    from pyrogram import types
+
+    from .api_types import ExtendedClient
 
 
 @dataclass
@@ -27,6 +32,19 @@ class Command:
     iscoro: bool = False
     enabled: bool = True
 
+    addon: Addon | None = None
+    handle: int | None = None
+
+
+def _remove_handle(index: dict[typing.Any, list[int]], key, handle: int):
+    handles = index.get(key)
+    if handles is None:
+        return
+
+    handles.remove(handle)
+    if not handles:
+        del index[key]
+
 
 @dataclass
 class MatchedCommand:
@@ -47,7 +65,23 @@ class CommandManager(BaseManager):
         self, addon: Addon | None = AddonNotSet, enabled: bool = True, log_level: int = logging.WARNING
     ):
         super().__init__(addon, enabled, log_level)
-        self._registered_commands: list[Command] = []
+        # Handle -> command. Handles are never reused, so they stay valid while other commands are removed
+        self._registered_commands: dict[int, Command] = {}
+        self._next_handle = 0
+
+        # (body, prefixes) -> handle
+        self._commands_by_key: dict[tuple[tuple[str], tuple[str]], int] = {}
+        # Body -> handles
+        self._commands_by_body: dict[str, list[int]] = {}
+        # Addon key -> handles
+        self._commands_by_addon: dict[Path | None, dict[int, None]] = {}
+        # Prefix -> body -> handles. Used to match command by the first word of message
+        self._match_index: dict[str, dict[str, list[int]]] = {}
+        # Commands with whitespace in body can't be matched by the first word
+        self._spaced_commands: dict[int, None] = {}
+
+        # Addon key -> commands registered while addon is reloading
+        self._reloading_addons: dict[Path | None, dict[tuple, Command]] = {}
 
         self._command_executes: list[CommandExecutionProcess] = []
 
@@ -58,7 +92,39 @@ class CommandManager(BaseManager):
         self._lock = AsyncNamedLock()
 
     def get_registered_commands(self):
-        return self._registered_commands.copy()
+        return list(self._registered_commands.values())
+
+    def get_command(self, handle: int) -> Command | None:
+        return self._registered_commands.get(handle)
+
+    def get_commands_by_body(self, body: str, prefix: str | None = None) -> list[Command]:
+        commands = [
+            self._registered_commands[handle]
+            for handle in self._commands_by_body.get(body.lower(), ())
+        ]
+
+        if prefix is not None:
+            commands = [command for command in commands if prefix in command.prefixes]
+
+        return commands
+
+    def get_prefixes(self) -> set[str]:
+        """Prefixes of commands registered in this manager and its included managers"""
+        prefixes = set(self._match_index)
+
+        for handle in self._spaced_commands:
+            prefixes.update(self._registered_commands[handle].prefixes)
+
+        for manager in self.get_included_managers():
+            prefixes |= manager.get_prefixes()
+
+        return prefixes
+
+    def get_addon_commands(self, addon: Addon | None) -> list[Command]:
+        return [
+            self._registered_commands[handle]
+            for handle in self._commands_by_addon.get(addon_key(addon), ())
+        ]
 
     def on_command(
         self,
@@ -97,7 +163,14 @@ class CommandManager(BaseManager):
         arguments: tuple = (),
         enabled: bool = True,
         owner_only: bool = True,
+        addon: Addon | None = AddonNotSet,
     ) -> int | None:
+        """
+        Register command. Returns handle of command, that can be used to remove it,
+        or None if command with the same body and prefixes is already registered.
+
+        Addon of command is the addon where callback is defined, if not set explicitly
+        """
         if not isinstance(prefixes, tuple) and not isinstance(prefixes, str):
             raise ValueError(
                 "Cannot operate on {type} as prefixes".format(type=str(type(prefixes)))
@@ -137,27 +210,8 @@ class CommandManager(BaseManager):
         if not isinstance(prefixes, tuple):
             prefixes = tuple(prefixes)
 
-        for registered_command in self._registered_commands:
-            if (
-                registered_command.body == body
-                and registered_command.prefixes == prefixes
-            ):
-
-                if (
-                    description == registered_command.description or description is None
-                ) and (arguments == registered_command.arguments or len(arguments) < 1):
-                    return
-
-                if (
-                    registered_command.description != description
-                    and description is not None
-                ):
-                    registered_command.description = description
-
-                if registered_command.arguments != arguments and len(arguments) > 0:
-                    registered_command.arguments = arguments
-
-                return
+        if addon is AddonNotSet:
+            addon = get_callback_addon(callback) or self._addon
 
         command = Command(
             callback=callback,
@@ -169,13 +223,68 @@ class CommandManager(BaseManager):
             iscoro=iscoroutinefunction(callback),
             enabled=enabled,
             owner_only=owner_only,
+            addon=addon,
         )
 
-        self._registered_commands.append(
-            command
-        )
+        reloading = self._reloading_addons.get(addon_key(addon))
+        if reloading is not None:
+            # Command will be added when addon reloading is finished
+            registered_command = reloading.get((body, prefixes))
+            if registered_command is not None:
+                self._update_command(registered_command, description, arguments)
+                return
+
+            command.handle = self._new_handle()
+            reloading[(body, prefixes)] = command
+            return command.handle
+
+        return self._add_command(command)
+
+    def _new_handle(self) -> int:
+        handle = self._next_handle
+        self._next_handle += 1
+        return handle
+
+    @staticmethod
+    def _update_command(command: Command, description: str | None, arguments: tuple):
+        if command.description != description and description is not None:
+            command.description = description
 
-        return self._registered_commands.index(command)
+        if command.arguments != arguments and len(arguments) > 0:
+            command.arguments = arguments
+
+    def _add_command(self, command: Command) -> int | None:
+        registered_handle = self._commands_by_key.get((command.body, command.prefixes))
+        if registered_handle is not None:
+            self._update_command(
+                self._registered_commands[registered_handle],
+                command.description,
+                command.arguments,
+            )
+            return
+
+        if command.handle is None:
+            command.handle = self._new_handle()
+
+        handle = command.handle
+
+        self._registered_commands[handle] = command
+        self._commands_by_key[(command.body, command.prefixes)] = handle
+        self._commands_by_addon.setdefault(addon_key(command.addon), {})[handle] = None
+
+        for body in command.body:
+            self._commands_by_body.setdefault(body, []).append(handle)
+
+            if " " in body or "\n" in body:
+                self._spaced_commands[handle] = None
+                continue
+
+            for prefix in command.prefixes:
+                self._match_index.setdefault(prefix, {}).setdefault(body, []).append(
+                    handle
+                )
+
+        return handle
 
     def describe_command(self, command: str, description: str, arguments: tuple):
         if not isinstance(command, str):
@@ -199,42 +308,141 @@ class CommandManager(BaseManager):
 
         command = command.lower()
 
-        for command_object in self._registered_commands:
-            if command_object.body == command:
-                command_object.description = description
-                command_object.arguments = arguments
-                break
-        else:
+        handles = self._commands_by_body.get(command)
+        if not handles:
             raise ValueError("Command {body} not found".format(body=command))
 
-    def remove_command(self, index: int):
-        try:
-            del self._registered_commands[index]
-            return True
-        except KeyError:
+        command_object = self._registered_commands[handles[0]]
+        command_object.description = description
+        command_object.arguments = arguments
+
+    def remove_command(self, handle: int) -> bool:
+        command = self._registered_commands.pop(handle, None)
+
+        if command is None:
             return False
 
-    def match_command(self, text: str) -> Command | None:
-        for command in self._registered_commands:
-            if not command.enabled:
+        del self._commands_by_key[(command.body, command.prefixes)]
+
+        key = addon_key(command.addon)
+        addon_commands = self._commands_by_addon[key]
+        del addon_commands[handle]
+        if not addon_commands:
+            del self._commands_by_addon[key]
+
+        self._spaced_commands.pop(handle, None)
+
+        for body in command.body:
+            _remove_handle(self._commands_by_body, body, handle)
+
+            for prefix in command.prefixes:
+                bodies = self._match_index.get(prefix)
+                if bodies is None:
+                    continue
+
+                _remove_handle(bodies, body, handle)
+                if not bodies:
+                    del self._match_index[prefix]
+
+        return True
+
+    def remove_addon_commands(self, addon: Addon | None) -> list[Command]:
+        """Remove all commands of addon. Takes time proportional to the number of addon commands"""
+        commands = self.get_addon_commands(addon)
+
+        for command in commands:
+            self.remove_command(command.handle)
+
+        return commands
+
+    @contextlib.contextmanager
+    def reload_addon(self, addon: Addon | None):
+        """
+        Replace commands of addon with commands registered inside this context.
+        Old commands keep working until the context exits, then they are replaced at once.
+        If error is raised inside the context, old commands are kept.
+        If command of other addon was registered with the same body and prefixes meanwhile,
+        old commands are kept and ValueError is raised
+        """
+        key = addon_key(addon)
+        if key in self._reloading_addons:
+            raise ValueError(f"Addon {addon} is already reloading")
+
+        reloading = self._reloading_addons[key] = {}
+
+        try:
+            yield
+        finally:
+            del self._reloading_addons[key]
+
+        for command_key in reloading:
+            handle = self._commands_by_key.get(command_key)
+            if handle is not None and addon_key(self._registered_commands[handle].addon) != key:
+                body, prefixes = command_key
+                raise ValueError(
+                    "Command {body} with prefixes {prefixes} is already registered by {addon}".format(
+                        body=body,
+                        prefixes=prefixes,
+                        addon=self._registered_commands[handle].addon,
+                    )
+                )
+
+        self.remove_addon_commands(addon)
+
+        for command in reloading.values():
+            self._add_command(command)
+
+    def _match_spaced_command(self, command: Command, text: str) -> bool:
+        for body in command.body:
+            if body not in text:
                 continue
+            for prefix in command.prefixes:
+                if not text.startswith(prefix):
+                    continue
+
+                text_without_prefix = text[len(prefix):]
 
-            for body in command.body:
-                if body not in text:
+                if not text_without_prefix.startswith(body):
                     continue
-                for prefix in command.prefixes:
-                    if not text.startswith(prefix):
-                        continue
 
-                    text_without_prefix = text[len(prefix):]
+                text_without_body = text_without_prefix[len(body):]
 
-                    if not text_without_prefix.startswith(body):
-                        continue
+                if len(text_without_body) == 0 or text_without_body[0] in ("\n", " "):
+                    return True
 
-                    text_without_body = text_without_prefix[len(body):]
+        return False
 
-                    if len(text_without_body) == 0 or text_without_body[0] in ("\n", " "):
-                        return command
+    def match_command(self, text: str) -> Command | None:
+        # The earliest registered command is matched. Handles are increasing, so it has the lowest handle
+        matched: int | None = None
+
+        for prefix, bodies in self._match_index.items():
+            if not text.startswith(prefix):
+                continue
+
+            # Body is the first word after prefix
+            end = len(text)
+            for separator in (" ", "\n"):
+                index = text.find(separator, len(prefix), end)
+                if index != -1:
+                    end = index
+
+            for handle in bodies.get(text[len(prefix):end], ()):
+                if (matched is None or handle < matched) and self._registered_commands[
+                    handle
+                ].enabled:
+                    matched = handle
+
+        for handle in self._spaced_commands:
+            if matched is not None and handle > matched:
+                continue
+
+            command = self._registered_commands[handle]
+            if command.enabled and self._match_spaced_command(command, text):
+                matched = handle
+
+        if matched is not None:
+            return self._registered_commands[matched]
 
     def check_execution(self, command: Command, chat_id: int):
         for executes in self._command_executes:
@@ -267,7 +475,7 @@ class CommandManager(BaseManager):
     def get_total_call_count(self):
         return sum(map(lambda rec: rec["call_count"], self.get_statistic()))
 
-    async def feed_message(self, client: ExtendedClient, message: types.Message):
+    async def feed_message(self, client: "ExtendedClient", message: "types.Message"):
         command = self.match_command(message.text)
 
         if not command:
@@ -309,8 +517,19 @@ class CommandManager(BaseManager):
 
             message.arguments = arguments
 
+            profiler = self.get_profiler()
+
             try:
-                if command.iscoro:
+                if profiler is not None:
+                    await profiler.run(
+                        self,
+                        command.addon,
+                        message.chat.id,
+                        command.callback,
+                        client,
+                        message,
+                    )
+                elif command.iscoro:
                     await command.callback(client, message)
                 else:
                     command.callback(client, message)
@@ -0,0 +1,330 @@
+import asyncio
+import collections
+import logging
+import time
+import typing
+from dataclasses import dataclass, field
+
+from pyrogram import utils, ContinuePropagation, StopPropagation
+from pyrogram.raw import types as raw_types
+from pyrogram.raw.base import Update
+
+from .api_types import ExtendedClient
+from .base import BaseManager
+from .command import CommandManager
+from .event import Event, EventManager, NewMessageEvent, get_event_chat_id
+from .peers import PeerStore
+
+
+def get_update_chat_id(update: Update) -> int | None:
+    """Get the chat id of raw update without parsing it. Returns None if update isn't related to chat"""
+    message = getattr(update, "message", None)
+    peer = getattr(message, "peer_id", None) or getattr(update, "peer", None)
+
+    if peer is not None:
+        try:
+            return utils.get_peer_id(peer)
+        except ValueError:
+            return None
+
+    channel_id = getattr(update, "channel_id", None)
+    if channel_id is not None:
+        return utils.get_channel_id(channel_id)
+
+    return None
+
+
+def record_update(
+    client: ExtendedClient,
+    raw_update: Update,
+    users: dict,
+    chats: dict,
+    managers: typing.Iterable[BaseManager],
+):
+    """Record raw update with recorders of event managers, that will receive it resolved"""
+    for manager in managers:
+        if isinstance(manager, EventManager):
+            recorder = manager.get_recorder()
+            if recorder is not None:
+                recorder.record(client, raw_update, users, chats)
+
+
+async def dispatch_update(
+    client: ExtendedClient,
+    raw_update: Update,
+    users: dict,
+    chats: dict,
+    managers: typing.Iterable[BaseManager],
+    peers: PeerStore | None = None,
+) -> bool:
+    """
+    Feed raw update to root managers in the given order, the same way pyrogram handlers would do.
+    Update is resolved once and command managers receive the parsed message of new message events.
+    Peer store, if passed, is used to resolve chats missing in the update.
+    Returns True if propagation was stopped
+    """
+    managers = tuple(managers)
+
+    if not isinstance(raw_update, Event):
+        record_update(client, raw_update, users, chats, managers)
+
+    event = await EventManager.resolve_event(
+        client=client, raw_event=raw_update, users=users, chats=chats, peers=peers
+    )
+
+    if event is None:
+        return False
+
+    for manager in managers:
+        try:
+            if isinstance(manager, CommandManager):
+                if not isinstance(event, NewMessageEvent) or not event.message.text:
+                    continue
+
+                await manager.execute(client, event.message)
+
+            elif isinstance(manager, EventManager):
+                await manager.execute(client, event, users, chats)
+
+        except ContinuePropagation:
+            continue
+        except StopPropagation:
+            return True
+
+    return False
+
+
+PRIORITY_LANE = "priority"
+BULK_LANE = "bulk"
+
+
+@dataclass
+class LaneStats:
+    updates: int = 0
+    failed: int = 0
+    # Time from receiving update till start of its handling
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+    # Time from receiving update till end of its handling, of the recent updates
+    latencies: collections.deque = field(
+        default_factory=lambda: collections.deque(maxlen=1000)
+    )
+
+    @property
+    def wait_mean(self) -> float:
+        return self.wait_total / self.updates if self.updates else 0.0
+
+    def latency_percentile(self, percent: float) -> float:
+        """Percentile of the recent latencies, interpolated between the closest ones"""
+        if not 0 <= percent <= 100:
+            raise ValueError(
+                "Cannot operate with {value} as percentile".format(value=repr(percent))
+            )
+
+        if not self.latencies:
+            return 0.0
+
+        latencies = sorted(self.latencies)
+        position = (len(latencies) - 1) * percent / 100
+        lower = int(position)
+        upper = min(lower + 1, len(latencies) - 1)
+
+        return latencies[lower] + (latencies[upper] - latencies[lower]) * (position - lower)
+
+
+class PriorityDispatcher:
+    """
+    Dispatches raw updates through two lanes, so owner commands aren't queued behind other updates.
+
+    Outgoing new messages, that start with a prefix of registered commands, are handled by
+    command managers in the priority lane. Then they, and all other updates, are handled by the rest
+    of managers in the bulk lane. Updates are classified by raw update fields, without parsing it.
+
+    Bulk lane workers have their own queues, updates are routed to them by chat, so updates of
+    one chat are handled in order. Commands reach the bulk lane after they are handled
+    in the priority lane, so they can be handled there after later updates of their chat
+    """
+
+    def __init__(
+        self,
+        managers: typing.Iterable[BaseManager],
+        peers: PeerStore | None = None,
+        bulk_workers: int = 1,
+        prefixes_ttl: float = 1.0,
+        log_level: int = logging.WARNING,
+    ):
+        if not isinstance(bulk_workers, int) or bulk_workers < 1:
+            raise ValueError(
+                "Cannot operate with {value} as workers count".format(
+                    value=repr(bulk_workers)
+                )
+            )
+
+        managers = tuple(managers)
+        self._command_managers = tuple(
+            manager for manager in managers if isinstance(manager, CommandManager)
+        )
+        self._bulk_managers = tuple(
+            manager for manager in managers if not isinstance(manager, CommandManager)
+        )
+        self._managers = managers
+        self._peers = peers
+
+        # Prefixes of commands are collected from managers trees at most once in prefixes_ttl seconds
+        self._prefixes_ttl = prefixes_ttl
+        self._prefixes: tuple[str, ...] = ()
+        self._prefixes_time: float | None = None
+
+        # Lane -> queues of lane workers
+        self._queues: dict[str, list[asyncio.Queue]] = {
+            PRIORITY_LANE: [asyncio.Queue()],
+            BULK_LANE: [asyncio.Queue() for _ in range(bulk_workers)],
+        }
+        self._stats = {lane: LaneStats() for lane in self._queues}
+        self._tasks: list[asyncio.Task] = []
+
+        self._logger = logging.getLogger(type(self).__name__)
+        self._logger.setLevel(log_level)
+
+    @property
+    def stats(self) -> dict[str, LaneStats]:
+        return self._stats
+
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    def get_prefixes(self) -> tuple[str, ...]:
+        now = time.monotonic()
+
+        if self._prefixes_time is None or now - self._prefixes_time > self._prefixes_ttl:
+            prefixes = set()
+            for manager in self._command_managers:
+                prefixes |= manager.get_prefixes()
+
+            self._prefixes = tuple(prefixes)
+            self._prefixes_time = now
+
+        return self._prefixes
+
+    def is_priority_update(self, update: Update) -> bool:
+        if not isinstance(
+            update, (raw_types.UpdateNewMessage, raw_types.UpdateNewChannelMessage)
+        ):
+            return False
+
+        message = update.message
+
+        return (
+            isinstance(message, raw_types.Message)
+            and message.out
+            and bool(message.message)
+            and message.message.startswith(self.get_prefixes())
+        )
+
+    async def feed_update(
+        self,
+        client: ExtendedClient,
+        update: Update,
+        users: dict,
+        chats: dict,
+    ):
+        """Can be used as pyrogram RawUpdateHandler callback"""
+        item = (time.perf_counter(), client, update, users, chats, self._managers)
+
+        if self._command_managers and self.is_priority_update(update):
+            await self._queues[PRIORITY_LANE][0].put(item)
+        else:
+            await self.get_bulk_queue(update).put(item)
+
+    def get_bulk_queue(self, update: Update | Event) -> asyncio.Queue:
+        queues = self._queues[BULK_LANE]
+        if len(queues) == 1:
+            return queues[0]
+
+        if isinstance(update, Event):
+            chat_id = get_event_chat_id(update)
+        else:
+            chat_id = get_update_chat_id(update)
+
+        return queues[hash(chat_id) % len(queues)]
+
+    def start(self):
+        """Start lanes workers. Must be called with running event loop"""
+        if self._tasks:
+            return
+
+        for lane, queues in self._queues.items():
+            for queue in queues:
+                self._tasks.append(asyncio.create_task(self._work(lane, queue)))
+
+    async def stop(self):
+        """Stop workers after they handle already received updates"""
+        if not self._tasks:
+            return
+
+        # Priority lane passes updates to bulk lane, so it's joined first
+        await self._queues[PRIORITY_LANE][0].join()
+        for queue in self._queues[BULK_LANE]:
+            await queue.join()
+
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _work(self, lane: str, queue: asyncio.Queue):
+        stats = self._stats[lane]
+
+        while True:
+            received, client, update, users, chats, managers = await queue.get()
+
+            start = time.perf_counter()
+            wait = start - received
+
+            try:
+                if lane == PRIORITY_LANE:
+                    await self._handle_priority(received, client, update, users, chats)
+                else:
+                    await dispatch_update(
+                        client, update, users, chats, managers, self._peers
+                    )
+            except Exception:
+                stats.failed += 1
+                self._logger.exception(f"Failed to handle update in {lane} lane")
+            finally:
+                queue.task_done()
+
+            stats.updates += 1
+            stats.wait_total += wait
+            if wait > stats.wait_max:
+                stats.wait_max = wait
+            stats.latencies.append(time.perf_counter() - received)
+
+    async def _handle_priority(
+        self,
+        received: float,
+        client: ExtendedClient,
+        update: Update,
+        users: dict,
+        chats: dict,
+    ):
+        # Bulk lane receives resolved event, so raw update is recorded here
+        record_update(client, update, users, chats, self._bulk_managers)
+
+        event = await EventManager.resolve_event(
+            client=client, raw_event=update, users=users, chats=chats, peers=self._peers
+        )
+
+        if event is None:
+            return
+
+        stopped = await dispatch_update(
+            client, event, users, chats, self._command_managers, self._peers
+        )
+
+        if not stopped and self._bulk_managers:
+            # Resolved event is passed, so it isn't resolved again
+            self.get_bulk_queue(event).put_nowait(
+                (received, client, event, users, chats, self._bulk_managers)
+            )
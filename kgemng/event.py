@@ -1,13 +1,20 @@
+import contextlib
+import heapq
 import json
 import logging
 import typing
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime
+from enum import Enum
 from inspect import iscoroutinefunction
+from pathlib import Path
 
 from RelativeAddonsSystem import Addon
 from magic_filter import F, MagicFilter
 from named_locks import AsyncNamedLock
 from pydantic import BaseModel
-from pyrogram import types, errors, StopPropagation
+from pyrogram import types, errors, utils, StopPropagation
 from pyrogram.raw import types as raw_types
 from pyrogram.raw.base import Update
 from pyrogram.raw.types import (
@@ -16,27 +23,80 @@ from pyrogram.raw.types import (
 )
 
 from .api_types import ExtendedClient, Account
-from .base import BaseManager, AddonNotSet, SkipMe
+from .base import BaseManager, AddonNotSet, SkipMe, addon_key, get_callback_addon
+from .filters import default_compiler, FilterContext, FilterIndex
+from .peers import PeerStore, get_cached_peer
+from .triggers import Trigger, TriggerIndex, TriggerMatch
+
+if typing.TYPE_CHECKING:
+    from .event_log import EventLogSink
+
+
+def json_default(value):
+    """
+    JSON encoder fallback for event fields. Pyrogram objects are encoded as in their __str__,
+    other values, that can't be encoded, are represented with repr
+    """
+    if isinstance(value, types.Object):
+        # The same as types.Object.default, but reads attributes once
+        elements = {"_": value.__class__.__name__}
+        for name, item in value.__dict__.items():
+            if item is not None and not name.startswith("_"):
+                elements[name] = "*" * 9 if name == "phone_number" else item
+
+        return elements
+
+    if isinstance(value, (Enum, datetime)):
+        return str(value)
+
+    return repr(value)
+
+
+def to_plain_data(value):
+    """
+    Copy of value as dicts, lists, strings and numbers, that is encoded to JSON the same way as value
+    with json_default. Copy doesn't change, when value is changed later
+    """
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+
+    if isinstance(value, dict):
+        return {key: to_plain_data(item) for key, item in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        return [to_plain_data(item) for item in value]
+
+    return to_plain_data(json_default(value))
 
 
 class BeautyModel(BaseModel):
-    def __str__(self):
+    def to_dict(self) -> dict:
+        """Fields of model. Pyrogram objects are left as is, so they are encoded in the same pass"""
         elements = {"_": self.__class__.__name__}
         for field in self.__fields__:
             value = getattr(self, field)
 
-            if isinstance(value, types.Object):
-                value = json.loads(str(value))
-
-            elif isinstance(value, Account):
+            if isinstance(value, Account):
                 value = str(value)
 
-            else:
+            elif not isinstance(value, types.Object):
                 value = repr(value)
 
             elements[field] = value
 
-        return json.dumps(elements, indent=4, ensure_ascii=False)
+        return elements
+
+    def to_json(self, indent: int | None = None) -> str:
+        return json.dumps(
+            self.to_dict(),
+            indent=indent,
+            separators=None if indent is not None else (",", ":"),
+            default=json_default,
+            ensure_ascii=False,
+        )
+
+    def __str__(self):
+        return self.to_json(indent=4)
 
 
 class Event(BeautyModel):
@@ -72,6 +132,88 @@ class EditedMessageEvent(Event):
     message: types.Message
 
 
+def get_event_chat_id(event: Event | None) -> int | None:
+    chat = getattr(getattr(event, "message", event), "chat", None)
+    return chat.id if chat is not None else None
+
+
+@dataclass
+class DispatchContext:
+    """Resolved raw update shared by all managers of the tree it is dispatched through"""
+
+    raw_event: typing.Any
+    event: Event | None
+    filter_context: FilterContext
+    # Triggers of all managers of the tree
+    trigger_index: TriggerIndex
+    trigger_matches: dict[Trigger, list[TriggerMatch]] | None = None
+
+    def match_triggers(self) -> dict[Trigger, list[TriggerMatch]]:
+        """Match message text against triggers of the tree. Text is scanned once per dispatch"""
+        if self.trigger_matches is None:
+            message = getattr(self.event, "message", None)
+            text = message and (message.text or message.caption)
+
+            self.trigger_matches = self.trigger_index.match(text) if text else {}
+
+        return self.trigger_matches
+
+
+class DispatchPlan:
+    """
+    Handlers of one event class with index of their filters.
+    Trigger handlers are selected by matched triggers, so handlers of not found keywords are not checked
+    """
+
+    def __init__(self, handlers: list[dict]):
+        self.handlers = handlers
+
+        # Positions of handlers, that are selected by filters index
+        self._filtered: list[int] = []
+        self._triggers: dict[Trigger, int] = {}
+
+        for position, handler in enumerate(handlers):
+            if handler["trigger"] is not None:
+                self._triggers[handler["trigger"]] = position
+            else:
+                self._filtered.append(position)
+
+        self._filter_index = FilterIndex(
+            [handlers[position]["compiled_filter"] for position in self._filtered]
+        )
+
+    def candidates(self, context: DispatchContext) -> typing.Iterable[int]:
+        """Positions of handlers, that should be checked, in ascending order"""
+        filtered = map(
+            self._filtered.__getitem__,
+            self._filter_index.candidates(context.filter_context),
+        )
+
+        if not self._triggers:
+            return filtered
+
+        triggered = sorted(
+            self._triggers[trigger]
+            for trigger in context.match_triggers()
+            if trigger in self._triggers
+        )
+
+        return heapq.merge(filtered, triggered)
+
+
+@dataclass
+class DispatchScope:
+    """Dispatch of one update through managers tree, opened by the root manager"""
+
+    context: DispatchContext | None = None
+
+
+# Outside of root manager execution there is no scope, and resolved events are not reused
+_dispatch_scope: ContextVar[DispatchScope | None] = ContextVar(
+    "kgemng_dispatch_scope", default=None
+)
+
+
 class EventManager(BaseManager):
     _parent: type["EventManager"] | None = None
 
@@ -83,8 +225,82 @@ class EventManager(BaseManager):
     ):
         super().__init__(addon, enabled, log_level)
         self.executable = self.feed_event
-        self._event_handlers = []
+        # Handle -> handler, in registration order
+        self._event_handlers: dict[int, dict] = {}
+        self._next_handle = 0
+        # Addon key -> handles
+        self._handlers_by_addon: dict[Path | None, dict[int, None]] = {}
+        # Addon key -> handlers registered while addon is reloading
+        self._reloading_addons: dict[Path | None, dict[int, dict]] = {}
+        # Handlers and filters index for each event class, built on first event of this class
+        self._dispatch_plans: dict[type, DispatchPlan] = {}
+        # Triggers of this manager and its included managers. Used only while manager is root
+        self._trigger_index = TriggerIndex()
         self._lock = AsyncNamedLock()
+        self._recorder = None
+        self._peer_store: PeerStore | None = None
+        self._event_sink: "EventLogSink | None" = None
+
+    def get_root(self) -> "EventManager":
+        manager = self
+        while manager.parent is not None:
+            manager = manager.parent
+
+        return manager
+
+    def _iter_triggers(self) -> typing.Iterator[Trigger]:
+        """Triggers of handlers of this manager and its included managers"""
+        for handler in self._event_handlers.values():
+            if handler["trigger"] is not None:
+                yield handler["trigger"]
+
+        for manager in self.get_included_managers():
+            yield from manager._iter_triggers()
+
+    def include_manager(self, value):
+        former_root = value.get_root() if isinstance(value, EventManager) else None
+        super().include_manager(value)
+
+        # Triggers are matched by index of the root manager, so they move to the new tree
+        root = self.get_root()
+        if former_root is not root:
+            for trigger in value._iter_triggers():
+                former_root._trigger_index.remove(trigger)
+                root._trigger_index.add(trigger)
+
+    def exclude_manager(self, value):
+        former_root = self.get_root()
+        super().exclude_manager(value)
+
+        for trigger in value._iter_triggers():
+            former_root._trigger_index.remove(trigger)
+            value._trigger_index.add(trigger)
+
+    def set_recorder(self, recorder):
+        """
+        Set recorder (e.g. kgemng.replay.UpdateRecorder) of raw updates that pass through this manager.
+
+        kgemng.dispatch feeds resolved events to managers, so it records raw updates itself
+        with recorders of root managers it is given
+        """
+        self._recorder = recorder
+
+    def get_recorder(self):
+        return self._recorder
+
+    def set_peer_store(self, peer_store: PeerStore | None):
+        """
+        Set persistent store of peers, used to resolve chats of updates.
+        Only the manager that resolves the update uses it, so it should be set on the root manager
+        """
+        self._peer_store = peer_store
+
+    def set_event_sink(self, event_sink: "EventLogSink | None"):
+        """
+        Set sink (e.g. kgemng.event_log.EventLogSink) of events resolved by this manager.
+        Events resolved by parent managers are not passed to it
+        """
+        self._event_sink = event_sink
 
     def on_message(self, filter_: MagicFilter = F, by_me: bool = False):
         def decorator(callback: typing.Callable):
@@ -97,9 +313,9 @@ class EventManager(BaseManager):
 
     def register_message_handler(
             self, callback: typing.Callable, filter_: MagicFilter = F, by_me: bool = False
-    ):
+    ) -> int:
 
-        self.register_event_handler(
+        return self.register_event_handler(
             NewMessageEvent, callback, filter_=filter_, by_me=by_me
         )
 
@@ -120,7 +336,7 @@ class EventManager(BaseManager):
             chat_id=None,
             chat_type=None,
             by_me: bool = True,
-    ):
+    ) -> int:
         filter_ = F.chat.id == chat_id & F.chat.type == chat_type
 
         if not chat_id:
@@ -130,10 +346,82 @@ class EventManager(BaseManager):
         elif not chat_type and not chat_id:
             filter_ = F
 
-        self.register_event_handler(
+        return self.register_event_handler(
             MessageReadEvent, callback=callback, filter_=filter_, by_me=by_me
         )
 
+    def on_trigger(
+            self,
+            keywords: str | tuple[str, ...],
+            filter_: MagicFilter = F,
+            by_me: bool = False,
+            whole_word: bool = True,
+            ignore_case: bool = True,
+            event: type[Event] = NewMessageEvent,
+    ):
+        def decorator(callback: typing.Callable):
+            self.register_trigger_handler(
+                callback=callback,
+                keywords=keywords,
+                filter_=filter_,
+                by_me=by_me,
+                whole_word=whole_word,
+                ignore_case=ignore_case,
+                event=event,
+            )
+            return callback
+
+        return decorator
+
+    def register_trigger_handler(
+            self,
+            callback: typing.Callable,
+            keywords: str | tuple[str, ...],
+            filter_: MagicFilter = F,
+            by_me: bool = False,
+            whole_word: bool = True,
+            ignore_case: bool = True,
+            event: type[Event] = NewMessageEvent,
+            addon: Addon | None = AddonNotSet,
+    ) -> int:
+        """
+        Register handler of messages, that contain any of keywords.
+        Keywords of all triggers are matched in one pass over message text (or caption).
+        Matches are available in handler as `event.message.matched_triggers`
+        """
+        if isinstance(keywords, str):
+            keywords = (keywords,)
+
+        if (
+                not isinstance(keywords, tuple)
+                or not keywords
+                or not all(isinstance(keyword, str) and keyword for keyword in keywords)
+        ):
+            raise ValueError(
+                "Cannot operate with {value} as trigger keywords".format(
+                    value=repr(keywords)
+                )
+            )
+
+        if not (
+                isinstance(event, type)
+                and issubclass(event, (NewMessageEvent, EditedMessageEvent))
+        ):
+            raise ValueError(
+                "Cannot operate with {type} as trigger event".format(type=repr(event))
+            )
+
+        return self._register_event_handler(
+            event,
+            callback,
+            filter_=filter_,
+            by_me=by_me,
+            addon=addon,
+            trigger=Trigger(
+                keywords=keywords, whole_word=whole_word, ignore_case=ignore_case
+            ),
+        )
+
     def on_event(
             self, event: type[Event], filter_: MagicFilter = F, by_me: bool = True
     ):
@@ -151,20 +439,141 @@ class EventManager(BaseManager):
             callback: typing.Callable,
             filter_: MagicFilter = F,
             by_me: bool = True,
-    ):
+            addon: Addon | None = AddonNotSet,
+    ) -> int:
+        """
+        Register event handler. Returns handle of handler, that can be used to remove it.
+
+        Addon of handler is the addon where callback is defined, if not set explicitly
+        """
+        return self._register_event_handler(
+            event, callback, filter_=filter_, by_me=by_me, addon=addon
+        )
+
+    def _register_event_handler(
+            self,
+            event: type[Event],
+            callback: typing.Callable,
+            filter_: MagicFilter = F,
+            by_me: bool = True,
+            addon: Addon | None = AddonNotSet,
+            trigger: Trigger | None = None,
+    ) -> int:
         if not iscoroutinefunction(callback):
             raise ValueError(
                 "This userbot doesn't supports the synchronous pyrogram handlers"
             )
 
-        self._event_handlers.append(
-            {
-                "event_type": event,
-                "filter": filter_,
-                "callback": callback,
-                "by_me": by_me,
-            }
-        )
+        if addon is AddonNotSet:
+            addon = get_callback_addon(callback) or self._addon
+
+        handle = self._next_handle
+        self._next_handle += 1
+
+        handler = {
+            "event_type": event,
+            "filter": filter_,
+            "callback": callback,
+            "by_me": by_me,
+            "compiled_filter": default_compiler.compile(filter_),
+            "addon": addon,
+            "handle": handle,
+            "trigger": trigger,
+        }
+
+        reloading = self._reloading_addons.get(addon_key(addon))
+        if reloading is not None:
+            # Handler will be added when addon reloading is finished
+            reloading[handle] = handler
+        else:
+            self._add_event_handler(handler)
+
+        return handle
+
+    def _add_event_handler(self, handler: dict):
+        handle = handler["handle"]
+
+        self._event_handlers[handle] = handler
+        self._handlers_by_addon.setdefault(addon_key(handler["addon"]), {})[handle] = None
+
+        # Staged handlers of reloading addon are not matched until they are added
+        if handler["trigger"] is not None:
+            self.get_root()._trigger_index.add(handler["trigger"])
+        self._dispatch_plans.clear()
+
+    def get_event_handlers(self) -> list[dict]:
+        return list(self._event_handlers.values())
+
+    def get_addon_event_handlers(self, addon: Addon | None) -> list[dict]:
+        return [
+            self._event_handlers[handle]
+            for handle in self._handlers_by_addon.get(addon_key(addon), ())
+        ]
+
+    def remove_event_handler(self, handle: int) -> bool:
+        handler = self._event_handlers.pop(handle, None)
+
+        if handler is None:
+            return False
+
+        key = addon_key(handler["addon"])
+        addon_handlers = self._handlers_by_addon[key]
+        del addon_handlers[handle]
+        if not addon_handlers:
+            del self._handlers_by_addon[key]
+
+        if handler["trigger"] is not None:
+            self.get_root()._trigger_index.remove(handler["trigger"])
+
+        self._dispatch_plans.clear()
+
+        return True
+
+    def remove_addon_event_handlers(self, addon: Addon | None) -> list[dict]:
+        """Remove all handlers of addon. Takes time proportional to the number of addon handlers"""
+        handlers = self.get_addon_event_handlers(addon)
+
+        for handler in handlers:
+            self.remove_event_handler(handler["handle"])
+
+        return handlers
+
+    @contextlib.contextmanager
+    def reload_addon(self, addon: Addon | None):
+        """
+        Replace handlers of addon with handlers registered inside this context.
+        Old handlers keep working until the context exits, then they are replaced at once.
+        If error is raised inside the context, old handlers are kept
+        """
+        key = addon_key(addon)
+        if key in self._reloading_addons:
+            raise ValueError(f"Addon {addon} is already reloading")
+
+        reloading = self._reloading_addons[key] = {}
+
+        try:
+            yield
+        finally:
+            del self._reloading_addons[key]
+
+        self.remove_addon_event_handlers(addon)
+
+        for handler in reloading.values():
+            self._add_event_handler(handler)
+
+    def get_dispatch_plan(self, event_type: type) -> DispatchPlan:
+        plan = self._dispatch_plans.get(event_type)
+
+        if plan is None:
+            plan = self._dispatch_plans[event_type] = DispatchPlan(
+                [
+                    handler
+                    for handler in self._event_handlers.values()
+                    if issubclass(event_type, handler["event_type"])
+                ]
+            )
+
+        return plan
 
     # noinspection PyProtectedMember
     @staticmethod
@@ -173,13 +582,22 @@ class EventManager(BaseManager):
             raw_event: Update,
             users: dict[int, types.User],
             chats: dict[int, types.Chat],
+            peers: PeerStore | None = None,
     ):
+        """
+        Parse raw update into event.
+        If peer store is passed, peers of update are saved to it and chats missing in update
+        are taken from it before requesting them from Telegram
+        """
 
         if isinstance(raw_event, Event):
             return raw_event
 
         account = client.account
 
+        if peers is not None:
+            peers.remember(account.id, users, chats)
+
         if isinstance(
                 raw_event,
                 (
@@ -214,7 +632,15 @@ class EventManager(BaseManager):
                     ),
             ):
                 peer_id = raw_event.channel_id
-                peer = users.get(peer_id) or chats.get(peer_id)
+                peer = await get_cached_peer(
+                    users,
+                    chats,
+                    peer_id,
+                    utils.get_channel_id(peer_id),
+                    raw_types.Channel,
+                    peers,
+                    account.id,
+                )
 
                 if isinstance(
                         raw_event,
@@ -244,7 +670,9 @@ class EventManager(BaseManager):
 
             elif isinstance(raw_event.peer, PeerUser):
                 peer_id = raw_event.peer.user_id
-                peer = users.get(peer_id) or chats.get(peer_id)
+                peer = await get_cached_peer(
+                    users, chats, peer_id, peer_id, raw_types.User, peers, account.id
+                )
 
                 if not peer:
                     chat = await client.get_chat(peer_id)
@@ -253,7 +681,9 @@ class EventManager(BaseManager):
 
             elif isinstance(raw_event.peer, PeerChat):
                 peer_id = raw_event.peer.chat_id
-                peer = users.get(peer_id) or chats.get(peer_id)
+                peer = await get_cached_peer(
+                    users, chats, peer_id, -peer_id, raw_types.Chat, peers, account.id
+                )
 
                 if not peer:
                     chat = await client.get_chat(peer_id)
@@ -286,10 +716,24 @@ class EventManager(BaseManager):
             chat = None
 
             if isinstance(raw_event, raw_types.UpdateDeleteChannelMessages):
-                try:
-                    chat = await client.get_chat(f"-100{raw_event.channel_id}")
-                except errors.PeerIdInvalid:
-                    return
+                peer = await get_cached_peer(
+                    users,
+                    chats,
+                    raw_event.channel_id,
+                    utils.get_channel_id(raw_event.channel_id),
+                    raw_types.Channel,
+                    peers,
+                    account.id,
+                )
+
+                if peer is not None:
+                    # noinspection PyTypeChecker
+                    chat = types.Chat._parse_channel_chat(client, peer)
+                else:
+                    try:
+                        chat = await client.get_chat(f"-100{raw_event.channel_id}")
+                    except errors.PeerIdInvalid:
+                        return
 
             return DeletedMessagesEvent(
                 messages=raw_event.messages, chat=chat, account=account
@@ -304,6 +748,17 @@ class EventManager(BaseManager):
 
             return EditedMessageEvent(account=account, message=message)
 
+    async def execute(self, *args, **kwargs):
+        if self.parent is not None:
+            return await super().execute(*args, **kwargs)
+
+        # Root manager starts new dispatch. Included managers reuse the event resolved by it
+        token = _dispatch_scope.set(DispatchScope())
+        try:
+            return await super().execute(*args, **kwargs)
+        finally:
+            _dispatch_scope.reset(token)
+
     async def feed_event(
             self,
             client: ExtendedClient,
@@ -311,21 +766,42 @@ class EventManager(BaseManager):
             users: dict[int, types.User],
             chats: dict[int, types.Chat],
     ):
-        async with self._lock.lock(client):
-            event = await self.resolve_event(
-                client=client, raw_event=raw_event, users=users, chats=chats
-            )
+        if self._recorder is not None and not isinstance(raw_event, Event):
+            self._recorder.record(client, raw_event, users, chats)
 
-            for handler in self._event_handlers:
-                event_type = handler.get("event_type")
-                if not isinstance(event, event_type):
-                    continue
+        async with self._lock.lock(client):
+            scope = _dispatch_scope.get()
+            context = scope.context if scope is not None else None
+
+            if context is None or context.raw_event is not raw_event:
+                event = await self.resolve_event(
+                    client=client,
+                    raw_event=raw_event,
+                    users=users,
+                    chats=chats,
+                    peers=self._peer_store,
+                )
+                context = DispatchContext(
+                    raw_event, event, FilterContext(event), self.get_root()._trigger_index
+                )
+                if scope is not None:
+                    scope.context = context
+
+                if self._event_sink is not None and event is not None:
+                    self._event_sink.submit(event)
+
+            event = context.event
+            filter_context = context.filter_context
+
+            plan = self.get_dispatch_plan(type(event))
+
+            for position in plan.candidates(context):
+                handler = plan.handlers[position]
 
-                filter_: MagicFilter = handler.get("filter")
                 by_me: bool = handler.get("by_me")
                 callback: typing.Callable = handler.get("callback")
 
-                if not filter_.resolve(event):
+                if not handler["compiled_filter"].check(filter_context):
                     continue
 
                 if isinstance(event, (NewMessageEvent, EditedMessageEvent)):
@@ -346,7 +822,18 @@ class EventManager(BaseManager):
                 ):
                     continue
 
-                result = await callback(event)
+                if handler["trigger"] is not None:
+                    event.message.matched_triggers = context.match_triggers()[
+                        handler["trigger"]
+                    ]
+
+                profiler = self.get_profiler()
+                if profiler is None:
+                    result = await callback(event)
+                else:
+                    result = await profiler.run(
+                        self, handler["addon"], get_event_chat_id(event), callback, event
+                    )
 
                 if event.skipped:
                     event.skipped = False
@@ -0,0 +1,227 @@
+import asyncio
+import collections
+import json
+import logging
+import time
+import typing
+from dataclasses import dataclass
+from pathlib import Path
+
+from .event import Event, to_plain_data
+
+
+@dataclass
+class EventLogStats:
+    submitted: int = 0
+    written: int = 0
+    # Events skipped by sampling, when queue is filled above the sampling threshold
+    sampled_out: int = 0
+    # Events dropped, because queue is full
+    dropped: int = 0
+    failed: int = 0
+
+
+class EventLogSink:
+    """
+    Writes events to rotating JSON lines file.
+
+    `submit` copies event as plain data and puts it to the queue, so event is logged as it was
+    submitted, not with changes made by handlers later. Events are encoded to JSON and written
+    in batches by background task in a thread. When queue is filled above `sample_threshold`,
+    only every `sample_every`-th event is queued, when it is full, events are dropped
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        max_bytes: int = 64 * 1024 * 1024,
+        backup_count: int = 5,
+        queue_size: int = 10_000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        sample_threshold: float = 0.5,
+        sample_every: int = 10,
+        log_level: int = logging.WARNING,
+    ):
+        for name, value in (
+            ("queue size", queue_size),
+            ("batch size", batch_size),
+            ("sampling rate", sample_every),
+        ):
+            if not isinstance(value, int) or value < 1:
+                raise ValueError(
+                    "Cannot operate with {value} as {name}".format(
+                        value=repr(value), name=name
+                    )
+                )
+
+        if not 0 < sample_threshold <= 1:
+            raise ValueError(
+                "Cannot operate with {value} as sampling threshold".format(
+                    value=repr(sample_threshold)
+                )
+            )
+
+        self._path = Path(path)
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._queue_size = queue_size
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._sample_size = int(queue_size * sample_threshold)
+        self._sample_every = sample_every
+
+        # Plain data of events
+        self._queue: collections.deque[dict] = collections.deque()
+        self._sample_counter = 0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+
+        self._file: typing.BinaryIO | None = None
+        self._stats = EventLogStats()
+
+        self._logger = logging.getLogger(type(self).__name__)
+        self._logger.setLevel(log_level)
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def stats(self) -> EventLogStats:
+        return self._stats
+
+    def is_running(self) -> bool:
+        return self._task is not None
+
+    def submit(self, event: Event):
+        """Queue event for writing. Doesn't block"""
+        self._stats.submitted += 1
+
+        queued = len(self._queue)
+
+        if queued >= self._queue_size:
+            self._stats.dropped += 1
+            return
+
+        if queued >= self._sample_size:
+            self._sample_counter += 1
+            if self._sample_counter % self._sample_every:
+                self._stats.sampled_out += 1
+                return
+
+        elements = {"time": time.time()}
+
+        try:
+            elements.update(to_plain_data(event.to_dict()))
+        except (TypeError, ValueError, RecursionError):
+            self._stats.failed += 1
+            self._logger.exception(f"Failed to copy {type(event).__name__}")
+            return
+
+        self._queue.append(elements)
+
+        if queued + 1 >= self._batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        """Start background writer. Must be called with running event loop"""
+        if self._task is not None:
+            return
+
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write queued events and stop background writer"""
+        if self._task is None:
+            return
+
+        self._closing = True
+        self._wakeup.set()
+
+        await self._task
+        self._task = None
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wakeup.clear()
+
+            while self._queue:
+                batch = [
+                    self._queue.popleft()
+                    for _ in range(min(self._batch_size, len(self._queue)))
+                ]
+
+                try:
+                    lines = await asyncio.to_thread(self._write_batch, batch)
+                except OSError:
+                    self._stats.failed += len(batch)
+                    self._logger.exception(f"Failed to write events to {self._path}")
+                else:
+                    self._stats.written += lines
+                    self._stats.failed += len(batch) - lines
+
+                # Let handlers run between batches
+                await asyncio.sleep(0)
+
+            if self._closing:
+                break
+
+    def _write_batch(self, batch: list[dict]) -> int:
+        """Encode events and write them. Runs in a thread. Returns count of written events"""
+        lines = []
+
+        for elements in batch:
+            try:
+                lines.append(
+                    json.dumps(
+                        elements, separators=(",", ":"), ensure_ascii=False
+                    ).encode()
+                    + b"\n"
+                )
+            except (TypeError, ValueError):
+                self._logger.exception(f"Failed to encode {elements.get('_')}")
+
+        if lines:
+            self._write(lines)
+
+        return len(lines)
+
+    def _write(self, lines: list[bytes]):
+        if self._file is None:
+            self._file = self._path.open("ab")
+
+        data = b"".join(lines)
+
+        if self._file.tell() and self._file.tell() + len(data) > self._max_bytes:
+            self._rotate()
+
+        self._file.write(data)
+        self._file.flush()
+
+    def _rotate(self):
+        self._file.close()
+
+        if self._backup_count > 0:
+            for index in range(self._backup_count - 1, 0, -1):
+                source = self._path.with_name(f"{self._path.name}.{index}")
+                if source.exists():
+                    source.replace(self._path.with_name(f"{self._path.name}.{index + 1}"))
+
+            self._path.replace(self._path.with_name(f"{self._path.name}.1"))
+            self._file = self._path.open("ab")
+        else:
+            self._file = self._path.open("wb")
+
+        self._logger.debug(f"Rotated {self._path}")
@@ -0,0 +1,310 @@
+import heapq
+import operator
+import typing
+import weakref
+
+from magic_filter import MagicFilter
+from magic_filter.exceptions import RejectOperations, SwitchModeToAll, SwitchModeToAny
+from magic_filter.operations import (
+    BaseOperation,
+    CombinationOperation,
+    ComparatorOperation,
+    GetAttributeOperation,
+)
+from magic_filter.util import and_op
+
+# Value of attribute path that cannot be resolved
+REJECTED = object()
+
+_RESOLVER = MagicFilter()
+
+
+class _Unhashable(Exception):
+    pass
+
+
+def _signature(value) -> typing.Hashable:
+    """Structural key of filter. Equal filters built separately get the same key"""
+    if isinstance(value, MagicFilter):
+        return MagicFilter, tuple(map(_signature, value._operations))
+
+    if isinstance(value, BaseOperation):
+        slots = []
+        for cls in type(value).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                slots.append((name, _signature(getattr(value, name))))
+
+        return type(value), tuple(slots)
+
+    if isinstance(value, (tuple, list)):
+        return type(value), tuple(map(_signature, value))
+
+    if isinstance(value, dict):
+        return dict, tuple((key, _signature(item)) for key, item in value.items())
+
+    try:
+        hash(value)
+    except TypeError:
+        raise _Unhashable
+
+    # Type is the part of key, because 1 == True, but F.a.is_(1) != F.a.is_(True)
+    return type(value), value
+
+
+class FilterTerm:
+    """
+    Part of compiled filter: attribute path lookup followed by the rest of operations.
+    Terms are shared between all filters compiled by the same compiler
+    """
+
+    __slots__ = ("path", "operations", "equals", "opaque", "__weakref__")
+
+    def __init__(
+        self,
+        path: tuple[str, ...] = (),
+        operations: tuple[BaseOperation, ...] = (),
+        opaque: typing.Any = None,
+    ):
+        self.path = path
+        self.operations = operations
+        self.opaque = opaque
+
+        # Term is "attribute path == constant" - can be checked with hash index
+        self.equals = REJECTED
+        if (
+            len(operations) == 1
+            and type(operations[0]) is ComparatorOperation
+            and operations[0].comparator is operator.eq
+            and not isinstance(operations[0].right, MagicFilter)
+        ):
+            try:
+                hash(operations[0].right)
+                self.equals = operations[0].right
+            except TypeError:
+                pass
+
+    def is_indexable(self) -> bool:
+        return self.equals is not REJECTED
+
+
+class CompiledFilter:
+    __slots__ = ("source", "terms", "index_term")
+
+    def __init__(self, source, terms: tuple[FilterTerm, ...]):
+        self.source = source
+        self.terms = terms
+        self.index_term = next((term for term in terms if term.is_indexable()), None)
+
+    def check(self, context: "FilterContext") -> bool:
+        for term in self.terms:
+            if not context.check(term):
+                return False
+
+        return True
+
+
+class FilterCompiler:
+    """
+    Compiles MagicFilter into conjunction of terms.
+    Top-level `&` of filters is split into separate terms, so `(F.a == 1) & F.b` shares
+    `F.a == 1` and `F.b` terms with other filters
+    """
+
+    def __init__(self):
+        # Terms are held by compiled filters of handlers, so terms of removed handlers are dropped
+        self._terms: weakref.WeakValueDictionary[
+            typing.Hashable, FilterTerm
+        ] = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self._terms)
+
+    def _intern(self, term: FilterTerm, source) -> FilterTerm:
+        try:
+            key = _signature(source)
+        except _Unhashable:
+            return term
+
+        return self._terms.setdefault(key, term)
+
+    def _split(self, filter_: MagicFilter) -> list[MagicFilter]:
+        operations = filter_._operations
+
+        for index, operation in enumerate(operations):
+            if (
+                type(operation) is CombinationOperation
+                and operation.combinator is and_op
+                and isinstance(operation.right, MagicFilter)
+            ):
+                break
+        else:
+            return [filter_]
+
+        tail = operations[index:]
+        # Only combinations in the tail can be split, operations applied to the result of combination can't
+        if not all(
+            type(operation) is CombinationOperation
+            and operation.combinator is and_op
+            and isinstance(operation.right, MagicFilter)
+            for operation in tail
+        ):
+            return [filter_]
+
+        parts = self._split(MagicFilter(operations[:index]))
+        for operation in tail:
+            parts.extend(self._split(operation.right))
+
+        return parts
+
+    def _compile_term(self, filter_: MagicFilter) -> FilterTerm:
+        operations = filter_._operations
+
+        path_length = 0
+        while (
+            path_length < len(operations)
+            and type(operations[path_length]) is GetAttributeOperation
+        ):
+            path_length += 1
+
+        return self._intern(
+            FilterTerm(
+                path=tuple(operation.name for operation in operations[:path_length]),
+                operations=operations[path_length:],
+            ),
+            filter_,
+        )
+
+    def compile(self, filter_) -> CompiledFilter:
+        if not isinstance(filter_, MagicFilter):
+            return CompiledFilter(filter_, (FilterTerm(opaque=filter_),))
+
+        return CompiledFilter(
+            filter_, tuple(map(self._compile_term, self._split(filter_)))
+        )
+
+
+default_compiler = FilterCompiler()
+
+
+class FilterContext:
+    """Per-event cache of attribute lookups and terms results"""
+
+    __slots__ = ("event", "_values", "_results")
+
+    def __init__(self, event):
+        self.event = event
+        self._values: dict[tuple[str, ...], typing.Any] = {(): event}
+        self._results: dict[FilterTerm, bool] = {}
+
+    def lookup(self, path: tuple[str, ...]):
+        try:
+            return self._values[path]
+        except KeyError:
+            pass
+
+        value = self.lookup(path[:-1])
+
+        if value is not REJECTED:
+            try:
+                value = getattr(value, path[-1])
+            except AttributeError:
+                value = REJECTED
+
+        self._values[path] = value
+        return value
+
+    def check(self, term: FilterTerm) -> bool:
+        try:
+            return self._results[term]
+        except KeyError:
+            pass
+
+        result = self._results[term] = bool(self._resolve(term))
+        return result
+
+    def _resolve(self, term: FilterTerm):
+        # Same as MagicFilter._resolve, but starts from cached attribute path value
+        if term.opaque is not None:
+            return term.opaque.resolve(self.event)
+
+        value = self.lookup(term.path)
+        rejected = value is REJECTED
+        if rejected:
+            value = None
+
+        operations = term.operations
+        for index, operation in enumerate(operations):
+            if rejected and not operation.important:
+                continue
+
+            try:
+                value = operation.resolve(value=value, initial_value=self.event)
+            except SwitchModeToAll:
+                return all(
+                    _RESOLVER._resolve(value=item, operations=operations[index + 1:])
+                    for item in value
+                )
+            except SwitchModeToAny:
+                return any(
+                    _RESOLVER._resolve(value=item, operations=operations[index + 1:])
+                    for item in value
+                )
+            except RejectOperations:
+                rejected = True
+                value = None
+                continue
+
+            rejected = False
+
+        return value
+
+
+class FilterIndex:
+    """
+    Selects filters that can pass for the event.
+    Filters with "attribute path == constant" term are indexed by that constant,
+    so filters of other values are not checked at all
+    """
+
+    def __init__(self, filters: typing.Sequence[CompiledFilter]):
+        self._unindexed: list[int] = []
+        self._indexes: dict[tuple[str, ...], dict[typing.Hashable, list[int]]] = {}
+        self._by_path: dict[tuple[str, ...], list[int]] = {}
+
+        for position, compiled in enumerate(filters):
+            term = compiled.index_term
+
+            if term is None:
+                self._unindexed.append(position)
+                continue
+
+            self._indexes.setdefault(term.path, {}).setdefault(term.equals, []).append(
+                position
+            )
+            self._by_path.setdefault(term.path, []).append(position)
+
+    def candidates(self, context: FilterContext) -> typing.Iterable[int]:
+        """Positions of filters, that should be checked, in ascending order"""
+        if not self._indexes:
+            return self._unindexed
+
+        selected = [self._unindexed]
+
+        for path, index in self._indexes.items():
+            value = context.lookup(path)
+
+            if value is REJECTED:
+                continue
+
+            try:
+                positions = index.get(value)
+            except TypeError:
+                positions = self._by_path[path]
+
+            if positions:
+                selected.append(positions)
+
+        if len(selected) == 1:
+            return selected[0]
+
+        return heapq.merge(*selected)
@@ -0,0 +1,355 @@
+import asyncio
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from pyrogram import utils
+from pyrogram.raw import types as raw_types
+from pyrogram.raw.core import TLObject
+
+from .codec import dumps, loads
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS peers (
+    account_id INTEGER NOT NULL,
+    peer_id INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    updated REAL NOT NULL,
+    is_min INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (account_id, peer_id)
+);
+CREATE INDEX IF NOT EXISTS peers_updated ON peers (updated);
+"""
+
+# Cached entry of peer, that is not stored
+_MISSING = (None, float("-inf"))
+
+# Min peers don't have valid access hash, so they don't replace full ones
+_UPSERT = (
+    "INSERT INTO peers (account_id, peer_id, data, updated, is_min) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (account_id, peer_id) DO UPDATE "
+    "SET data = excluded.data, updated = excluded.updated, is_min = excluded.is_min "
+    "WHERE excluded.is_min = 0 OR peers.is_min = 1"
+)
+
+
+def is_min_peer(peer: TLObject) -> bool:
+    return bool(getattr(peer, "min", False))
+
+
+def get_peer_id(peer: TLObject) -> int | None:
+    """Marked id of raw user, chat or channel (the same as pyrogram chat id)"""
+    if isinstance(peer, (raw_types.User, raw_types.UserEmpty)):
+        return peer.id
+
+    if isinstance(peer, (raw_types.Chat, raw_types.ChatForbidden, raw_types.ChatEmpty)):
+        return -peer.id
+
+    if isinstance(peer, (raw_types.Channel, raw_types.ChannelForbidden)):
+        return utils.get_channel_id(peer.id)
+
+    return None
+
+
+class PeerStore:
+    """
+    Persistent store of raw users, chats and channels seen in updates, so chats can be resolved
+    without requests to Telegram after restart.
+
+    Peers are written behind: they are collected in memory and written to SQLite in bulk
+    by `flush_periodically`, in a thread, every `interval` seconds or when `batch_size` peers
+    are pending, and on close. Peers missing in memory are read from SQLite in a thread too.
+    Peers are stored per account, because access hashes differ between accounts.
+    Every entry has update time: entries older than `max_age` are not returned,
+    and the oldest entries are removed when there are more than `max_entries`
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        max_entries: int = 100_000,
+        max_age: float | None = None,
+        refresh_interval: float = 60.0,
+        batch_size: int = 500,
+        cache_size: int = 10_000,
+        log_level: int = logging.WARNING,
+    ):
+        for name, value in (
+            ("max entries", max_entries),
+            ("batch size", batch_size),
+            ("cache size", cache_size),
+        ):
+            if not isinstance(value, int) or value < 1:
+                raise ValueError(
+                    "Cannot operate with {value} as {name}".format(
+                        value=repr(value), name=name
+                    )
+                )
+
+        self._path = Path(path)
+        self._max_entries = max_entries
+        self._max_age = max_age
+        self._refresh_interval = refresh_interval
+        self._batch_size = batch_size
+        self._cache_size = cache_size
+
+        # Connection is used from threads, one at a time
+        self._connection = sqlite3.connect(self._path, check_same_thread=False)
+        self._connection_lock = threading.Lock()
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(peers)")}
+        if "is_min" not in columns:
+            self._connection.execute(
+                "ALTER TABLE peers ADD COLUMN is_min INTEGER NOT NULL DEFAULT 0"
+            )
+
+        # Upper bound of stored entries count. Stored entries are counted only when it's exceeded
+        (self._entries,) = self._connection.execute(
+            "SELECT COUNT(*) FROM peers"
+        ).fetchone()
+
+        # (account id, peer id) -> (peer, update time)
+        self._cache: OrderedDict[tuple[int, int], tuple[TLObject | None, float]] = OrderedDict()
+        self._pending: dict[tuple[int, int], tuple[TLObject, float]] = {}
+        # Peers taken from pending, that are being written
+        self._writing: dict[tuple[int, int], tuple[TLObject, float]] = {}
+        self._wakeup = asyncio.Event()
+
+        self._logger = logging.getLogger(type(self).__name__)
+        self._logger.setLevel(log_level)
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def is_closed(self) -> bool:
+        return self._connection is None
+
+    def _cache_entry(self, key: tuple[int, int], entry: tuple[TLObject | None, float]):
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def remember(self, account_id: int | None, users: dict, chats: dict):
+        """Save peers of update. Peer is rewritten at most once in `refresh_interval` seconds"""
+        if self._connection is None:
+            return
+
+        now = time.time()
+        account_id = account_id or 0
+
+        for peer in itertools.chain(users.values(), chats.values()):
+            peer_id = get_peer_id(peer)
+            if peer_id is None:
+                continue
+
+            key = account_id, peer_id
+            cached, updated = self._cache.get(key, _MISSING)
+
+            if cached is not None:
+                if now - updated < self._refresh_interval:
+                    continue
+
+                if is_min_peer(peer) and not is_min_peer(cached):
+                    continue
+
+            # Full peer can be stored, but not cached, so the database decides if min peer is written
+            if cached is not None or not is_min_peer(peer):
+                self._cache_entry(key, (peer, now))
+
+            self._pending[key] = (peer, now)
+
+        if len(self._pending) >= self._batch_size:
+            self._wakeup.set()
+
+    async def get(self, account_id: int | None, peer_id: int) -> TLObject | None:
+        """Get raw peer by marked id (the same as pyrogram chat id)"""
+        if self._connection is None:
+            return None
+
+        key = account_id or 0, peer_id
+
+        entry = self._cache.get(key)
+        if entry is None:
+            pending = self._pending.get(key) or self._writing.get(key)
+
+            if pending is not None and not is_min_peer(pending[0]):
+                entry = pending
+            else:
+                row = await asyncio.to_thread(self._read, key)
+                entry = (loads(row[0]), row[1]) if row is not None else pending or _MISSING
+
+        self._cache_entry(key, entry)
+
+        peer, updated = entry
+        if self._max_age is not None and time.time() - updated > self._max_age:
+            return None
+
+        return peer
+
+    def _read(self, key: tuple[int, int]) -> tuple[bytes, float] | None:
+        with self._connection_lock:
+            if self._connection is None:
+                return None
+
+            return self._connection.execute(
+                "SELECT data, updated FROM peers WHERE account_id = ? AND peer_id = ?",
+                key,
+            ).fetchone()
+
+    @staticmethod
+    def _make_rows(pending: dict[tuple[int, int], tuple[TLObject, float]]) -> list[tuple]:
+        return [
+            (account_id, peer_id, dumps(peer), updated, is_min_peer(peer))
+            for (account_id, peer_id), (peer, updated) in pending.items()
+        ]
+
+    def _write_rows(self, rows: list[tuple]) -> bool:
+        """Write rows to the database under connection lock. Returns True if old entries were removed"""
+        with self._connection:
+            self._connection.executemany(_UPSERT, rows)
+
+        self._entries += len(rows)
+        trimmed = self._entries > self._max_entries
+        if trimmed:
+            self._trim()
+
+        self._logger.debug(f"Wrote {len(rows)} peers to {self._path}")
+        return trimmed
+
+    def _write(self, pending: dict[tuple[int, int], tuple[TLObject, float]]) -> bool:
+        """Write peers to the database. Returns True if old entries were removed"""
+        rows = self._make_rows(pending)
+
+        with self._connection_lock:
+            # Store was closed meanwhile, then these peers are written by close
+            if self._connection is None:
+                return False
+
+            return self._write_rows(rows)
+
+    def _take_pending(self) -> dict[tuple[int, int], tuple[TLObject, float]]:
+        self._writing, self._pending = self._pending, {}
+        return self._writing
+
+    def flush(self):
+        """Write pending peers to the database, blocking"""
+        if self._connection is None or not self._pending:
+            return
+
+        try:
+            trimmed = self._write(self._take_pending())
+        finally:
+            self._writing = {}
+
+        if trimmed:
+            # Cached entries could be removed from the database
+            self._cache.clear()
+
+    async def flush_async(self):
+        """Write pending peers to the database in a thread"""
+        if self._connection is None or not self._pending:
+            return
+
+        try:
+            trimmed = await asyncio.to_thread(self._write, self._take_pending())
+        finally:
+            self._writing = {}
+
+        if trimmed:
+            self._cache.clear()
+
+    def _trim(self):
+        with self._connection:
+            if self._max_age is not None:
+                self._connection.execute(
+                    "DELETE FROM peers WHERE updated < ?", (time.time() - self._max_age,)
+                )
+
+            (entries,) = self._connection.execute("SELECT COUNT(*) FROM peers").fetchone()
+
+            if entries > self._max_entries:
+                self._connection.execute(
+                    "DELETE FROM peers WHERE rowid IN "
+                    "(SELECT rowid FROM peers ORDER BY updated LIMIT ?)",
+                    (entries - self._max_entries,),
+                )
+                self._logger.debug(
+                    f"Removed {entries - self._max_entries} oldest peers from {self._path}"
+                )
+                entries = self._max_entries
+
+        self._entries = entries
+
+    async def flush_periodically(self, interval: float = 5.0):
+        """Write pending peers every `interval` seconds or when `batch_size` peers are pending"""
+        while self._connection is not None:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wakeup.clear()
+
+            try:
+                await self.flush_async()
+            except sqlite3.Error:
+                self._logger.exception(f"Failed to write peers to {self._path}")
+
+    def close(self):
+        """
+        Write pending peers and close the database.
+        Peers, that are being written by `flush_periodically` in a thread, are written too,
+        so the flush task doesn't have to be stopped before. Blocks until the thread finishes writing
+        """
+        with self._connection_lock:
+            if self._connection is None:
+                return
+
+            pending = {**self._writing, **self._pending}
+            self._pending = {}
+
+            try:
+                if pending:
+                    self._write_rows(self._make_rows(pending))
+            finally:
+                self._connection.close()
+                self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+async def get_cached_peer(
+    users: dict,
+    chats: dict,
+    raw_id: int,
+    peer_id: int,
+    peer_type: type[TLObject],
+    peers: PeerStore | None = None,
+    account_id: int | None = None,
+) -> TLObject | None:
+    """
+    Get raw peer from users and chats of update by raw id, then from peer store by marked id.
+    Stored peer is returned only if it is instance of peer_type
+    """
+    peer = users.get(raw_id) or chats.get(raw_id)
+
+    if peer is None and peers is not None:
+        stored = await peers.get(account_id, peer_id)
+        if isinstance(stored, peer_type):
+            peer = stored
+
+    return peer
@@ -0,0 +1,240 @@
+import cProfile
+import collections
+import inspect
+import io
+import logging
+import pstats
+import time
+import typing
+from dataclasses import dataclass
+from pathlib import Path
+
+from RelativeAddonsSystem import Addon
+
+if typing.TYPE_CHECKING:
+    from .base import BaseManager
+
+# Addon name, manager class name, handler qualified name
+CallKey = tuple[str, str, str]
+
+
+@dataclass
+class CallStats:
+    calls: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.calls if self.calls else 0.0
+
+
+@dataclass
+class SlowCall:
+    addon: str
+    manager: str
+    handler: str
+    chat_id: int | None
+    started: float
+    duration: float
+
+
+def get_call_key(
+    manager: "BaseManager", addon: Addon | None, callback: typing.Callable
+) -> CallKey:
+    addon_name = addon.meta.name if isinstance(addon, Addon) else "NO ADDON"
+
+    return (
+        addon_name,
+        type(manager).__name__,
+        getattr(callback, "__qualname__", None) or repr(callback),
+    )
+
+
+class HandlerProfiler:
+    """
+    Measures handlers and commands callbacks of managers it is set to.
+    Calls are attributed to addon of handler or command, that can differ from addon of its manager.
+
+    Every call is timed. Calls longer than `slow_threshold` seconds are logged and kept in `slow_calls`.
+    Every `profile_every`-th call is run under cProfile, profiles are aggregated per handler.
+    cProfile measures the whole thread, so profile of handler, that awaits, includes other
+    tasks running at that time. Only one call is profiled at a time
+    """
+
+    def __init__(
+        self,
+        slow_threshold: float | None = 0.5,
+        profile_every: int | None = None,
+        max_slow_calls: int = 1000,
+        log_level: int = logging.WARNING,
+    ):
+        if profile_every is not None and (
+            not isinstance(profile_every, int) or profile_every < 1
+        ):
+            raise ValueError(
+                "Cannot operate with {value} as profiling rate".format(
+                    value=repr(profile_every)
+                )
+            )
+
+        self._slow_threshold = slow_threshold
+        self._profile_every = profile_every
+
+        self._calls = 0
+        self._profiling = False
+
+        self._stats: dict[CallKey, CallStats] = {}
+        self._profiles: dict[CallKey, pstats.Stats] = {}
+        self._slow_calls: collections.deque[SlowCall] = collections.deque(
+            maxlen=max_slow_calls
+        )
+
+        self._logger = logging.getLogger(type(self).__name__)
+        self._logger.setLevel(log_level)
+
+    @property
+    def stats(self) -> dict[CallKey, CallStats]:
+        return self._stats
+
+    @property
+    def slow_calls(self) -> list[SlowCall]:
+        return list(self._slow_calls)
+
+    def reset(self):
+        self._stats.clear()
+        self._profiles.clear()
+        self._slow_calls.clear()
+
+    async def run(
+        self,
+        manager: "BaseManager",
+        addon: Addon | None,
+        chat_id: int | None,
+        callback: typing.Callable,
+        *args,
+    ):
+        """Call callback (sync or async) of handler or command of addon with arguments and measure it"""
+        self._calls += 1
+
+        profile = None
+        if (
+            self._profile_every is not None
+            and not self._profiling
+            and self._calls % self._profile_every == 0
+        ):
+            profile = cProfile.Profile()
+            self._profiling = True
+
+        started = time.time()
+        start = time.perf_counter()
+
+        try:
+            if profile is not None:
+                profile.enable()
+
+            result = callback(*args)
+            if inspect.isawaitable(result):
+                result = await result
+        finally:
+            duration = time.perf_counter() - start
+
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+
+            self._record(manager, addon, callback, chat_id, started, duration, profile)
+
+        return result
+
+    def _record(
+        self,
+        manager: "BaseManager",
+        addon: Addon | None,
+        callback: typing.Callable,
+        chat_id: int | None,
+        started: float,
+        duration: float,
+        profile: cProfile.Profile | None,
+    ):
+        key = get_call_key(manager, addon, callback)
+
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = CallStats()
+
+        stats.calls += 1
+        stats.total += duration
+        if duration > stats.max:
+            stats.max = duration
+
+        if profile is not None:
+            aggregated = self._profiles.get(key)
+            if aggregated is None:
+                self._profiles[key] = pstats.Stats(profile)
+            else:
+                aggregated.add(profile)
+
+        if self._slow_threshold is not None and duration >= self._slow_threshold:
+            addon, manager_name, handler = key
+            self._slow_calls.append(
+                SlowCall(
+                    addon=addon,
+                    manager=manager_name,
+                    handler=handler,
+                    chat_id=chat_id,
+                    started=started,
+                    duration=duration,
+                )
+            )
+            self._logger.warning(
+                "Slow call of %s (addon %s, %s, chat %s) took %.2fms",
+                handler,
+                addon,
+                manager_name,
+                chat_id,
+                duration * 1000,
+            )
+
+    def get_profile(self, key: CallKey | None = None) -> pstats.Stats | None:
+        """Aggregated profile of handler, or of all handlers if key is not passed"""
+        if key is not None:
+            return self._profiles.get(key)
+
+        if not self._profiles:
+            return None
+
+        return pstats.Stats().add(*self._profiles.values())
+
+    def dump_profile(self, path: str | Path, key: CallKey | None = None) -> bool:
+        """Write aggregated profile in pstats format. Returns False if nothing was profiled"""
+        profile = self.get_profile(key)
+
+        if profile is None:
+            return False
+
+        profile.dump_stats(path)
+        return True
+
+    def report(self, limit: int = 20) -> str:
+        """Text report: handlers sorted by total time and top functions of aggregated profile"""
+        output = io.StringIO()
+
+        output.write(
+            f"{'calls':>8} {'total ms':>10} {'mean ms':>9} {'max ms':>9}  handler\n"
+        )
+        for (addon, manager, handler), stats in sorted(
+            self._stats.items(), key=lambda item: item[1].total, reverse=True
+        )[:limit]:
+            output.write(
+                f"{stats.calls:>8} {stats.total * 1000:>10.2f} {stats.mean * 1000:>9.3f} "
+                f"{stats.max * 1000:>9.3f}  {addon}:{manager}:{handler}\n"
+            )
+
+        profile = self.get_profile()
+        if profile is not None:
+            output.write("\n")
+            profile.stream = output
+            profile.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+
+        return output.getvalue()
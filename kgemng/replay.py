@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import struct
+import time
+import typing
+from dataclasses import dataclass
+from pathlib import Path
+
+from pyrogram import Client, enums, types, utils
+from pyrogram.client import Cache
+from pyrogram.raw import types as raw_types
+from pyrogram.raw.base import Update
+
+from .api_types import ExtendedClient, Account
+from .base import BaseManager
+from .codec import encode_update, decode_update
+from .dispatch import dispatch_update
+
+MAGIC = b"KGEMREC1"
+
+# timestamp, payload length
+_FRAME = struct.Struct("<dI")
+
+
+class UpdateRecorder:
+    """
+    Append-only recorder of raw updates.
+
+    Every record is a frame header (receive time and payload length) followed by update encoded with
+    kgemng.codec. Can be used as pyrogram RawUpdateHandler callback or attached to EventManager
+    """
+
+    def __init__(self, path: str | Path, log_level: int = logging.WARNING):
+        self._path = Path(path)
+        self._file = self._path.open("ab")
+
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+        self._records = 0
+
+        self._logger = logging.getLogger(type(self).__name__)
+        self._logger.setLevel(log_level)
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def records(self) -> int:
+        return self._records
+
+    def is_closed(self) -> bool:
+        return self._file.closed
+
+    def record(
+        self,
+        client: ExtendedClient,
+        update: Update,
+        users: dict,
+        chats: dict,
+    ):
+        if self._file.closed:
+            return
+
+        payload = encode_update(client.account.id, update, users, chats)
+
+        self._file.write(_FRAME.pack(time.time(), len(payload)))
+        self._file.write(payload)
+
+        self._records += 1
+
+    async def feed_update(
+        self,
+        client: ExtendedClient,
+        update: Update,
+        users: dict,
+        chats: dict,
+    ):
+        self.record(client, update, users, chats)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+
+        self._file.close()
+        self._logger.debug(f"Recorded {self._records} updates to {self._path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def read_records(
+    path: str | Path,
+) -> typing.Iterator[tuple[float, int | None, Update, dict, dict]]:
+    """Iterate over records of file written by UpdateRecorder"""
+    with Path(path).open("rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an updates record file")
+
+        while header := file.read(_FRAME.size):
+            if len(header) < _FRAME.size:
+                # Last record was not written completely
+                break
+
+            timestamp, length = _FRAME.unpack(header)
+
+            payload = file.read(length)
+            if len(payload) < length:
+                break
+
+            yield timestamp, *decode_update(payload)
+
+
+class ReplayClient(ExtendedClient):
+    """
+    Stand-in client for replaying updates without connection to Telegram.
+
+    API requests are not sent, they are saved to `invoked` and return None.
+    Chats that are missing in the recorded update are resolved to empty chat objects,
+    discussion messages - to empty messages of these chats
+    """
+
+    # noinspection PyMissingConstructor
+    def __init__(self, account_id: int | None):
+        self.name = f"replay-{account_id}"
+        self.me = types.User(id=account_id or 0, is_self=True)
+        self.parse_mode = None
+        self.message_cache = Cache(10000)
+
+        self.invoked = []
+
+        # Stand-in is always connected, so it isn't connected by sharded dispatcher workers
+        self.is_connected = True
+        self.is_initialized = False
+
+        Account(self)
+
+    async def get_me(self):
+        return self.me
+
+    async def disconnect(self):
+        self.is_connected = False
+
+    async def invoke(self, query, *args, **kwargs):
+        self.invoked.append(query)
+
+    async def resolve_peer(self, peer_id):
+        if isinstance(peer_id, int) and peer_id > 0:
+            return raw_types.InputPeerUser(user_id=peer_id, access_hash=0)
+
+        return raw_types.InputPeerEmpty()
+
+    async def get_chat(self, chat_id):
+        chat_id = int(chat_id)
+        chat_type = {
+            "user": enums.ChatType.PRIVATE,
+            "chat": enums.ChatType.GROUP,
+            "channel": enums.ChatType.CHANNEL,
+        }[utils.get_peer_type(chat_id)]
+
+        return types.Chat(id=chat_id, type=chat_type, client=self)
+
+    async def get_discussion_message(self, chat_id, message_id):
+        # Discussion group isn't known without request, so message is in the chat itself
+        return types.Message(id=message_id, chat=await self.get_chat(chat_id), client=self)
+
+
+@dataclass
+class ReplayStats:
+    updates: int
+    failed: int
+    elapsed: float
+
+    @property
+    def rate(self) -> float:
+        return self.updates / self.elapsed if self.elapsed else 0.0
+
+
+class UpdateReplayer:
+    def __init__(
+        self,
+        path: str | Path,
+        client_factory: typing.Callable[[int | None], Client] = ReplayClient,
+        log_level: int = logging.WARNING,
+    ):
+        self._path = Path(path)
+        self._client_factory = client_factory
+        self._clients: dict[int | None, ExtendedClient] = {}
+
+        self._logger = logging.getLogger(type(self).__name__)
+        self._logger.setLevel(log_level)
+
+    async def get_client(self, account_id: int | None) -> ExtendedClient:
+        client = self._clients.get(account_id)
+
+        if client is None:
+            client = self._clients[account_id] = self._client_factory(account_id)
+            await client.account.resolve_info()
+
+        return client
+
+    async def replay(
+        self,
+        managers: typing.Iterable[BaseManager],
+        speed: float | None = None,
+    ) -> ReplayStats:
+        """
+        Feed recorded updates to root managers in recorded order.
+
+        :param managers: root managers
+        :param speed: replay speed relative to the original one. None - as fast as possible
+        """
+        if speed is not None and speed <= 0:
+            raise ValueError(
+                "Cannot operate with {value} as replay speed".format(value=repr(speed))
+            )
+
+        managers = tuple(managers)
+
+        updates = failed = 0
+        first_timestamp = None
+        start = time.perf_counter()
+
+        for timestamp, account_id, update, users, chats in read_records(self._path):
+            if speed is not None:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+
+                delay = (timestamp - first_timestamp) / speed - (
+                    time.perf_counter() - start
+                )
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            client = await self.get_client(account_id)
+
+            try:
+                await dispatch_update(client, update, users, chats, managers)
+            except Exception:
+                failed += 1
+                self._logger.exception("Failed to replay update")
+
+            updates += 1
+
+        return ReplayStats(
+            updates=updates, failed=failed, elapsed=time.perf_counter() - start
+        )
@@ -0,0 +1,295 @@
+import asyncio
+import inspect
+import logging
+import multiprocessing
+import os
+import typing
+
+from pyrogram.raw.base import Update
+
+from .api_types import ExtendedClient
+from .base import BaseManager
+from .codec import encode_update, decode_update
+from .dispatch import dispatch_update, get_update_chat_id
+
+ROUTE_BY_CHAT = "chat"
+ROUTE_BY_ACCOUNT = "account"
+
+ManagersFactory = typing.Callable[[], typing.Iterable[BaseManager]]
+# Returns client (or awaitable of it) of account. Worker connects client, if it isn't connected.
+# Client is used in worker process alongside the main one, so it should have its own session
+ClientFactory = typing.Callable[
+    [int | None], ExtendedClient | typing.Awaitable[ExtendedClient]
+]
+
+
+async def _make_client(
+    client_factory: ClientFactory, account_id: int | None
+) -> ExtendedClient:
+    client = client_factory(account_id)
+    if inspect.isawaitable(client):
+        client = await client
+
+    if not client.is_connected:
+        # Updates are received by the main process, so client is only connected to send requests
+        if not await client.connect():
+            await client.disconnect()
+            raise ConnectionError(f"Session of account {account_id} is not authorized")
+
+    try:
+        # Handlers read account info, e.g. to check if message is sent by account
+        await client.account.resolve_info()
+    except BaseException:
+        await _close_client(client)
+        raise
+
+    return client
+
+
+async def _close_client(client: ExtendedClient):
+    if client.is_initialized:
+        await client.stop()
+    elif client.is_connected:
+        await client.disconnect()
+
+
+async def _serve(
+    index: int,
+    queue: multiprocessing.Queue,
+    managers_factory: ManagersFactory,
+    client_factory: ClientFactory,
+    logger: logging.Logger,
+):
+    loop = asyncio.get_running_loop()
+
+    managers = list(managers_factory())
+    # Clients are created by tasks, so updates of the same account, handled concurrently,
+    # wait for the same client
+    clients: dict[int | None, asyncio.Task] = {}
+
+    # Last scheduled task for each routing key. Every new task waits for the previous one,
+    # so updates of one chat are handled in order while different chats are handled concurrently
+    tails: dict[typing.Hashable, asyncio.Task] = {}
+
+    async def handle(previous: asyncio.Task | None, key: typing.Hashable, data: bytes):
+        if previous is not None:
+            await asyncio.wait((previous,))
+
+        try:
+            account_id, update, users, chats = decode_update(data)
+
+            client_task = clients.get(account_id)
+            if client_task is None:
+                client_task = clients[account_id] = asyncio.create_task(
+                    _make_client(client_factory, account_id)
+                )
+
+            try:
+                client = await client_task
+            except Exception:
+                # Client is created again for the next update of account
+                if clients.get(account_id) is client_task:
+                    del clients[account_id]
+                raise
+
+            await dispatch_update(client, update, users, chats, managers)
+        except Exception:
+            logger.exception(f"Worker {index} failed to handle update")
+        finally:
+            if tails.get(key) is asyncio.current_task():
+                del tails[key]
+
+    logger.debug(f"Worker {index} started")
+
+    while True:
+        item = await loop.run_in_executor(None, queue.get)
+
+        if item is None:
+            break
+
+        key, data = item
+        tails[key] = asyncio.create_task(handle(tails.get(key), key, data))
+
+    if tails:
+        await asyncio.wait(tuple(tails.values()))
+
+    for client_task in clients.values():
+        try:
+            await _close_client(await client_task)
+        except Exception:
+            logger.exception(f"Worker {index} failed to close client")
+
+    logger.debug(f"Worker {index} stopped")
+
+
+def _worker_main(
+    index: int,
+    queue: multiprocessing.Queue,
+    managers_factory: ManagersFactory,
+    client_factory: ClientFactory,
+    log_level: int,
+):
+    logger = logging.getLogger(f"{ShardedDispatcher.__name__}.worker-{index}")
+    logger.setLevel(log_level)
+
+    try:
+        asyncio.run(_serve(index, queue, managers_factory, client_factory, logger))
+    except KeyboardInterrupt:
+        pass
+
+
+class ShardedDispatcher:
+    """
+    Routes raw updates to worker processes, each running its own managers tree.
+
+    Updates are routed by account or by chat, so all updates of the same chat (or account)
+    are handled by the same worker in the order they were received.
+    Factories are passed to worker processes, so they must be picklable (module-level functions).
+    Worker connects clients it creates, so handlers can send requests, and disconnects them when stopped
+    """
+
+    def __init__(
+        self,
+        managers_factory: ManagersFactory,
+        client_factory: ClientFactory,
+        workers: int | None = None,
+        route_by: str = ROUTE_BY_CHAT,
+        restart_workers: bool = True,
+        log_level: int = logging.WARNING,
+    ):
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError(
+                "Cannot operate with {value} as workers count".format(value=repr(workers))
+            )
+
+        if route_by not in (ROUTE_BY_CHAT, ROUTE_BY_ACCOUNT):
+            raise ValueError(
+                "Cannot route updates by {value}".format(value=repr(route_by))
+            )
+
+        self._managers_factory = managers_factory
+        self._client_factory = client_factory
+        self._route_by = route_by
+        self._restart_workers = restart_workers
+        self._log_level = log_level
+
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue() for _ in range(workers)]
+        self._processes: list[multiprocessing.Process | None] = [None] * workers
+
+        self._running = False
+
+        self._logger = logging.getLogger(type(self).__name__)
+        self._logger.setLevel(log_level)
+
+    @property
+    def workers(self) -> int:
+        return len(self._queues)
+
+    def is_running(self) -> bool:
+        return self._running
+
+    def _start_worker(self, index: int):
+        if self._processes[index] is not None:
+            # Dead worker could hold the queue read lock forever, so restarted worker gets a fresh queue
+            self._queues[index] = self._context.Queue()
+
+        process = self._context.Process(
+            target=_worker_main,
+            args=(
+                index,
+                self._queues[index],
+                self._managers_factory,
+                self._client_factory,
+                self._log_level,
+            ),
+            name=f"kgemng-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+
+        self._logger.debug(f"Started worker {index} (pid {process.pid})")
+
+    def start(self):
+        if self._running:
+            return
+
+        self._running = True
+
+        for index in range(self.workers):
+            self._start_worker(index)
+
+    def stop(self, timeout: float | None = None):
+        """Stop workers after they handle already received updates"""
+        if not self._running:
+            return
+
+        self._running = False
+
+        for queue in self._queues:
+            queue.put(None)
+
+        for index, process in enumerate(self._processes):
+            process.join(timeout)
+
+            if process.is_alive():
+                self._logger.warning(f"Worker {index} didn't stop in time. Terminating it")
+                process.terminate()
+                process.join()
+
+            self._processes[index] = None
+
+    def check_workers(self) -> int:
+        """Restart dead workers. Updates that were queued for or handled by dead worker are lost"""
+        if not self._running or not self._restart_workers:
+            return 0
+
+        restarted = 0
+        for index, process in enumerate(self._processes):
+            if process is not None and process.is_alive():
+                continue
+
+            self._logger.warning(
+                f"Worker {index} is dead (exit code {process and process.exitcode}). Restarting it"
+            )
+            self._start_worker(index)
+            restarted += 1
+
+        return restarted
+
+    async def watch_workers(self, interval: float = 1.0):
+        while self._running:
+            self.check_workers()
+            await asyncio.sleep(interval)
+
+    def get_route_key(self, account_id: int | None, update: Update) -> typing.Hashable:
+        if self._route_by == ROUTE_BY_ACCOUNT:
+            return account_id
+
+        return account_id, get_update_chat_id(update)
+
+    def get_shard(self, key: typing.Hashable) -> int:
+        return hash(key) % self.workers
+
+    async def feed_update(
+        self,
+        client: ExtendedClient,
+        update: Update,
+        users: dict,
+        chats: dict,
+    ):
+        """Can be used as pyrogram RawUpdateHandler callback"""
+        if not self._running:
+            raise ValueError("Dispatcher is not running")
+
+        account_id = client.account.id
+
+        key = self.get_route_key(account_id, update)
+
+        self._queues[self.get_shard(key)].put(
+            (key, encode_update(account_id, update, users, chats))
+        )
@@ -0,0 +1,196 @@
+import re
+import typing
+from dataclasses import dataclass
+
+
+@dataclass(eq=False)
+class Trigger:
+    keywords: tuple[str, ...]
+    whole_word: bool = True
+    ignore_case: bool = True
+
+
+@dataclass
+class TriggerMatch:
+    keyword: str
+    start: int
+    end: int
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def _trie_pattern(node: dict) -> str:
+    # Terminal node is marked with "" key. Children are optional, so the longest keyword is matched
+    branches = []
+    for char, child in node.items():
+        if char:
+            branches.append(re.escape(char) + _trie_pattern(child))
+
+    if not branches:
+        return ""
+
+    if len(branches) == 1 and "" not in node:
+        return branches[0]
+
+    return "(?:" + "|".join(branches) + ")" + ("?" if "" in node else "")
+
+
+class KeywordMatcher:
+    """
+    Finds all occurrences of keywords in text in a single pass.
+
+    Keywords are compiled into one regular expression shaped as a trie, that finds the longest
+    keyword at every position. Shorter keywords at the same position are its prefixes,
+    so they are taken from the precomputed table.
+    Ignoring case, keywords and text are case folded the same way, and positions in folded text
+    are mapped back to the text
+    """
+
+    def __init__(self, keywords: typing.Iterable[str], ignore_case: bool = False):
+        self._ignore_case = ignore_case
+
+        keywords = {self.normalize(keyword) for keyword in keywords if keyword}
+
+        trie = {}
+        for keyword in keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[""] = {}
+
+        self._prefixes: dict[str, tuple[str, ...]] = {
+            keyword: tuple(
+                keyword[:length]
+                for length in range(len(keyword), 0, -1)
+                if keyword[:length] in keywords
+            )
+            for keyword in keywords
+        }
+
+        self._pattern = re.compile(
+            "(?=(" + _trie_pattern(trie) + "))"
+        ) if keywords else None
+
+    def normalize(self, keyword: str) -> str:
+        return keyword.casefold() if self._ignore_case else keyword
+
+    def finditer(self, text: str) -> typing.Iterator[tuple[str, int, int]]:
+        """Yield normalized keyword, start and end of every occurrence of keywords in text"""
+        if self._pattern is None:
+            return
+
+        normalized = self.normalize(text)
+
+        # Folded form of some characters (e.g. "ß", "İ") is longer, then positions are shifted
+        positions = None
+        if len(normalized) != len(text):
+            positions = [
+                index for index, char in enumerate(text) for _ in range(len(char.casefold()))
+            ]
+            positions.append(len(text))
+
+        for match in self._pattern.finditer(normalized):
+            start = match.start()
+
+            for keyword in self._prefixes[match.group(1)]:
+                end = start + len(keyword)
+
+                if positions is None:
+                    yield keyword, start, end
+                # Keyword that starts or ends inside folded form of character doesn't match the text
+                elif (start == 0 or positions[start] != positions[start - 1]) and positions[
+                    end
+                ] != positions[end - 1]:
+                    yield keyword, positions[start], positions[end]
+
+
+class TriggerIndex:
+    """
+    Registry of triggers of managers tree.
+    Keywords of all triggers are matched against text at once, matchers are rebuilt on first match
+    after triggers are changed
+    """
+
+    def __init__(self):
+        self._triggers: dict[Trigger, None] = {}
+        # ignore_case -> normalized keyword -> triggers
+        self._keywords: dict[bool, dict[str, dict[Trigger, None]]] = {
+            False: {},
+            True: {},
+        }
+        self._matchers: dict[bool, KeywordMatcher] | None = None
+
+    def __len__(self):
+        return len(self._triggers)
+
+    @staticmethod
+    def _normalize(trigger: Trigger) -> set[str]:
+        if trigger.ignore_case:
+            return {keyword.casefold() for keyword in trigger.keywords}
+
+        return set(trigger.keywords)
+
+    def add(self, trigger: Trigger):
+        if trigger in self._triggers:
+            return
+
+        self._triggers[trigger] = None
+
+        keywords = self._keywords[trigger.ignore_case]
+        for keyword in self._normalize(trigger):
+            keywords.setdefault(keyword, {})[trigger] = None
+
+        self._matchers = None
+
+    def remove(self, trigger: Trigger):
+        if trigger not in self._triggers:
+            return
+
+        del self._triggers[trigger]
+
+        keywords = self._keywords[trigger.ignore_case]
+        for keyword in self._normalize(trigger):
+            triggers = keywords[keyword]
+            del triggers[trigger]
+            if not triggers:
+                del keywords[keyword]
+
+        self._matchers = None
+
+    def get_matchers(self) -> dict[bool, KeywordMatcher]:
+        if self._matchers is None:
+            self._matchers = {
+                ignore_case: KeywordMatcher(keywords, ignore_case)
+                for ignore_case, keywords in self._keywords.items()
+                if keywords
+            }
+
+        return self._matchers
+
+    def match(self, text: str) -> dict[Trigger, list[TriggerMatch]]:
+        """Match text against all triggers. Returns matches of triggers that matched"""
+        result: dict[Trigger, list[TriggerMatch]] = {}
+
+        if not text:
+            return result
+
+        for ignore_case, matcher in self.get_matchers().items():
+            keywords = self._keywords[ignore_case]
+
+            for keyword, start, end in matcher.finditer(text):
+                bounded = (start == 0 or not _is_word_char(text[start - 1])) and (
+                    end == len(text) or not _is_word_char(text[end])
+                )
+
+                for trigger in keywords[keyword]:
+                    if trigger.whole_word and not bounded:
+                        continue
+
+                    result.setdefault(trigger, []).append(
+                        TriggerMatch(keyword=keyword, start=start, end=end)
+                    )
+
+        return result
+